@@ -24,6 +24,9 @@ argparser.add_argument('--clean_bvbrc',required=False,action='store_true',help='
 
 argparser.add_argument('--scan_input',required=False,action='store_true',help='If specified, will assume the input is the path to a directory of file(s) and list them as input')
 argparser.add_argument('--rename_files_dir',required=False,default=None,help='If specified with a path, will assume the input is a path of file(s) and attempt to rename them into the specified directory')
+argparser.add_argument('--dedup',required=False,action='store_true',help='If specified with --rename_files_dir, will hash input files and store identical content once. Duplicates are hardlinked')
+argparser.add_argument('--dedup_index',required=False,default=None,help='Path to hash index used with --dedup, so files are not re-hashed on later runs (default: <rename_files_dir>/.flexmetr_hash_index.tsv)')
+argparser.add_argument('--threads',required=False,type=int,default=1,help='Number of files to hash in parallel with --dedup (default: 1)')
 
 argparser.add_argument('--notify_missing',required=False,action='store_true',help='If specified, will assume each row in the input is an accession number and notify the user if there is no database entry')
 argparser.add_argument('--skip_missing',required=False,action='store_true',help='If specified, will assume each row in the input is an accession number and skip the entry if there is no match for the entry in the database')
@@ -52,7 +55,7 @@ args = argparser.parse_args()
 input_file = args.input
 output_file = args.output
 
-metadata_db = args.database
+# metadata_db = args.database # not implemented yet (see -d/--database above)
 metadata_columns = args.column
 out_separator = args.separator
 
@@ -61,6 +64,9 @@ clean_bvbrc = args.clean_bvbrc
 
 scan_input = args.scan_input
 rename_input_into_dir = args.rename_files_dir
+dedup = args.dedup
+dedup_index_path = args.dedup_index
+threads = args.threads
 
 notify_missing = args.notify_missing
 skip_missing = args.skip_missing
@@ -288,12 +294,24 @@ if rename_input_into_dir:
     print('Making new directory: '+rename_input_into_dir)
     if not os.path.exists(rename_input_into_dir):       os.makedirs(rename_input_into_dir)
     #/
+    # check if hash input files to deduplicate content
+    files_hashes = None
+    if dedup:
+        if dedup_index_path == None:
+            dedup_index_path = rename_input_into_dir+'/'+'.flexmetr_hash_index.tsv'
+        files_hashes = global_functions.get_files_hashes(input_string_split,index_path=dedup_index_path,threads=threads)
+        print('Hashed input files, N='+str(len(files_hashes))+', unique contents N='+str(len(set(files_hashes.values()))))
+    #/
     # do copy-in with formatting in the new directory
     print('Copying and formatting input files into new directory')
+    digests_targets = {} # digest -> first copied file with this content (used with --dedup)
     for i,_ in enumerate(input_string_split):
         source_file = input_string_split[i]
         target_file = rename_input_into_dir + '/' + output_string_split[i]
-        shutil.copy(source_file,target_file)
+        if files_hashes != None:
+            global_functions.copy_file_deduplicated(source_file,target_file,files_hashes[source_file],digests_targets,copy_function=shutil.copy)
+        else:
+            shutil.copy(source_file,target_file)
     #/
     # reset output_string so it doesnt print
     output_string = ''
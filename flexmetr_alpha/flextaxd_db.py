@@ -0,0 +1,107 @@
+import os
+import sqlite3
+
+# FlexTaxD database schema. Indexes are made after the bulk load, see FlexTaxDDatabaseWriter
+FLEXTAXD_SCHEMA = [
+    'CREATE TABLE nodes (id INTEGER PRIMARY KEY, name TEXT NOT NULL)',
+    'CREATE TABLE rank (rank_i INTEGER PRIMARY KEY, rank TEXT NOT NULL)',
+    'CREATE TABLE tree (id INTEGER PRIMARY KEY, parent INTEGER NOT NULL, child INTEGER NOT NULL, rank_i INTEGER, FOREIGN KEY (parent) REFERENCES nodes (id), FOREIGN KEY (child) REFERENCES nodes (id), FOREIGN KEY (rank_i) REFERENCES rank (rank_i))',
+    'CREATE TABLE genomes (id INTEGER NOT NULL, genome TEXT NOT NULL, FOREIGN KEY (id) REFERENCES nodes (id))',
+]
+FLEXTAXD_INDEXES = [
+    'CREATE UNIQUE INDEX nodes_name ON nodes (name)',
+    'CREATE UNIQUE INDEX rank_rank ON rank (rank)',
+    'CREATE UNIQUE INDEX tree_parent_child ON tree (parent,child)',
+    'CREATE INDEX tree_child ON tree (child)',
+    'CREATE UNIQUE INDEX genomes_genome ON genomes (genome)',
+    'CREATE INDEX genomes_id ON genomes (id)',
+]
+FLEXTAXD_ROOT_NAME = 'root'
+FLEXTAXD_NO_RANK = 'no rank'
+
+class FlexTaxDDatabaseWriter:
+    """
+    Writes a FlexTaxD-schema SQLite database in one transaction. Relations and genomes are buffered and inserted in
+    batches with executemany, and the indexes are made once all rows are loaded. Nodes and ranks get their ids when
+    first seen (id 1 is the FlexTaxD root node). The database is written to a temporary file and moved into place by
+    close(), so an interrupted run does not leave a partial database.
+    """
+    def __init__(self,database_path,batch_size=100000):
+        self.database_path = database_path
+        self.tmp_path = database_path+'.tmp'
+        self.batch_size = batch_size
+        if os.path.exists(self.tmp_path):       os.remove(self.tmp_path)
+        self.conn = sqlite3.connect(self.tmp_path,isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode = OFF') # fresh file, nothing to roll back to
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('BEGIN')
+        for statement in FLEXTAXD_SCHEMA:
+            self.conn.execute(statement)
+        self.nodes_ids = {} # node name -> id
+        self.ranks_ids = {} # rank -> rank_i
+        self.nodes_batch = []
+        self.tree_batch = []
+        self.genomes_batch = []
+        self.num_genomes = 0
+        self.num_genomes_skipped = 0 # genomes with a node that is not in the tree
+        # add root (parent of itself, as in FlexTaxD)
+        root_id = self.get_node_id(FLEXTAXD_ROOT_NAME)
+        self.tree_batch.append((root_id,root_id,self.get_rank_id(FLEXTAXD_NO_RANK)))
+        #/
+    
+    def get_node_id(self,name):
+        if not name in self.nodes_ids:
+            self.nodes_ids[name] = len(self.nodes_ids)+1
+            self.nodes_batch.append((self.nodes_ids[name],name))
+        return self.nodes_ids[name]
+    
+    def get_rank_id(self,rank):
+        if not rank in self.ranks_ids:
+            self.ranks_ids[rank] = len(self.ranks_ids)+1
+            self.conn.execute('INSERT INTO rank (rank_i,rank) VALUES (?,?)',(self.ranks_ids[rank],rank))
+        return self.ranks_ids[rank]
+    
+    def add_relation(self,parent,child,rank=None):
+        """
+        Adds the edge parent->child. A parent of None links child to the root. Rank applies to child ("no rank" if empty).
+        """
+        if parent == None:      parent = FLEXTAXD_ROOT_NAME
+        self.tree_batch.append((self.get_node_id(parent),self.get_node_id(child),self.get_rank_id(rank or FLEXTAXD_NO_RANK)))
+        if len(self.tree_batch) >= self.batch_size:     self.flush()
+    
+    def add_genome(self,genome,node_name):
+        """
+        Maps genome to node_name. Returns False (and skips the genome) if node_name is not a node of the tree.
+        """
+        if not node_name in self.nodes_ids:
+            self.num_genomes_skipped += 1
+            return False
+        self.genomes_batch.append((self.nodes_ids[node_name],genome))
+        self.num_genomes += 1
+        if len(self.genomes_batch) >= self.batch_size:      self.flush()
+        return True
+    
+    def flush(self):
+        if self.nodes_batch:
+            self.conn.executemany('INSERT INTO nodes (id,name) VALUES (?,?)',self.nodes_batch)
+            self.nodes_batch = []
+        if self.tree_batch:
+            self.conn.executemany('INSERT INTO tree (parent,child,rank_i) VALUES (?,?,?)',self.tree_batch)
+            self.tree_batch = []
+        if self.genomes_batch:
+            self.conn.executemany('INSERT INTO genomes (id,genome) VALUES (?,?)',self.genomes_batch)
+            self.genomes_batch = []
+    
+    def close(self):
+        """
+        Loads remaining rows, drops duplicate edges and genomes (first one added is kept), makes the indexes and moves
+        the database into place.
+        """
+        self.flush()
+        self.conn.execute('DELETE FROM tree WHERE id NOT IN (SELECT MIN(id) FROM tree GROUP BY parent,child)')
+        self.conn.execute('DELETE FROM genomes WHERE rowid NOT IN (SELECT MIN(rowid) FROM genomes GROUP BY genome)')
+        for statement in FLEXTAXD_INDEXES:
+            self.conn.execute(statement)
+        self.conn.execute('COMMIT')
+        self.conn.close()
+        os.replace(self.tmp_path,self.database_path)
@@ -1,6 +1,9 @@
 
 import os
 import re
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 def parse_metadata_file(input_file,header_present=True,accession_column=0,separator='\t',
                         strip_quotes=False,accessions_to_import=set(),cols_to_import=set(),
@@ -160,3 +163,84 @@ def get_accessions_adjacent_text(input_string,matches):
     
     return matches_wAdj_text
 
+def hash_file(file_path,block_size=1048576):
+    """
+    Returns the SHA-256 hexdigest of the content of a file, read in blocks.
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path,'rb') as f:
+        for block in iter(lambda: f.read(block_size),b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def load_file_hash_index(index_path):
+    """
+    Parses a hash index file (path, size, mtime_ns, sha256; tab-separated).
+    Returns a dict: path -> (size,mtime_ns,sha256)
+    """
+    index = {}
+    if index_path and os.path.exists(index_path):
+        with open(index_path,'r') as f:
+            for line in f:
+                line = line.strip('\n').split('\t')
+                if len(line) != 4: continue # skip malformed rows
+                path,size,mtime_ns,digest = line
+                index[path] = (int(size),int(mtime_ns),digest)
+    return index
+
+def write_file_hash_index(index_path,index):
+    """
+    Writes the hash index to file. Written to a temporary file first so an interrupted run does not leave a truncated index.
+    """
+    tmp_path = index_path+'.tmp'
+    with open(tmp_path,'w') as nf:
+        for path,(size,mtime_ns,digest) in index.items():
+            nf.write('\t'.join([path,str(size),str(mtime_ns),digest])+'\n')
+    os.replace(tmp_path,index_path)
+
+def get_files_hashes(file_paths,index_path=None,threads=1):
+    """
+    Returns a dict: file_path -> sha256 of file content.
+    Hashes are looked up in the index at index_path (keyed by absolute path, size and mtime) and only files that are
+    missing or changed since they were indexed are hashed (in parallel). The index is updated with the new hashes.
+    """
+    index = load_file_hash_index(index_path)
+    
+    # check which files need to be hashed
+    files_hashes = {}
+    files_to_hash = [] # [[file_path,index_key,size,mtime_ns], ...]
+    for file_path in file_paths:
+        file_stat = os.stat(file_path)
+        index_key = os.path.abspath(file_path)
+        if index_key in index and index[index_key][:2] == (file_stat.st_size,file_stat.st_mtime_ns):
+            files_hashes[file_path] = index[index_key][2]
+        else:
+            files_to_hash.append([file_path,index_key,file_stat.st_size,file_stat.st_mtime_ns])
+    #/
+    # hash files (hashlib releases the GIL on large blocks, so threads run in parallel)
+    if files_to_hash:
+        with ThreadPoolExecutor(max_workers=max(1,threads)) as executor:
+            digests = executor.map(hash_file,[file_path for file_path,_,_,_ in files_to_hash])
+            for (file_path,index_key,size,mtime_ns),digest in zip(files_to_hash,digests):
+                files_hashes[file_path] = digest
+                index[index_key] = (size,mtime_ns,digest)
+        if index_path:
+            write_file_hash_index(index_path,index)
+    #/
+    return files_hashes
+
+def copy_file_deduplicated(source_file,target_file,digest,digests_targets,copy_function=shutil.copy2):
+    """
+    Copies source_file to target_file, unless a file with identical content (digest) was already copied. Then a hardlink
+    to that copy is made instead. digests_targets (digest -> first target path) is updated in place.
+    Returns True if the file was copied and False if it was hardlinked.
+    """
+    if digest in digests_targets:
+        try:
+            os.link(digests_targets[digest],target_file)
+            return False
+        except OSError:
+            pass # e.g. filesystem without hardlink support. Fall back to a copy
+    copy_function(source_file,target_file)
+    if not digest in digests_targets:       digests_targets[digest] = target_file
+    return True
@@ -4,6 +4,9 @@ import os
 import sys
 import argparse
 import shutil
+import heapq
+import random
+from concurrent.futures import ThreadPoolExecutor
 
 import global_functions
 
@@ -21,6 +24,17 @@ argparser.add_argument('--select_values',required=True,help='Value in selected c
 
 argparser.add_argument('--group_by',required=True,help='Column in metadata to group output by')
 
+argparser.add_argument('--max_per_group',required=False,type=int,default=None,help='If specified, will select at most this number (at least 1) of genomes per group. Selection is done before any file is touched (default: not set)')
+argparser.add_argument('--sample_seed',required=False,type=int,default=0,help='Seed for the random selection used with --max_per_group. Each group is sampled with its own generator derived from the seed and the group value (default: 0)')
+argparser.add_argument('--sample_sort_column',required=False,default=None,help='If specified with a column in metadata, will select the genomes with the highest values in this column with --max_per_group instead of a random selection (default: not set)')
+argparser.add_argument('--sample_sort_ascending',required=False,action='store_true',help='If specified, will select the lowest values of --sample_sort_column instead of the highest')
+
+argparser.add_argument('--archive',required=False,default=None,choices=('tar','tar.gz','zip'),help='If specified, will write each group into a single archive (<output>/<group>.<archive>) instead of a directory of files (default: not set)')
+argparser.add_argument('--threads',required=False,type=int,default=1,help='Number of groups to write (and files to hash) in parallel (default: 1)')
+
+argparser.add_argument('--dedup',required=False,action='store_true',help='If specified, will hash input files and store identical content once. Duplicates are hardlinked (in tar-archives: stored as hardlink members)')
+argparser.add_argument('--dedup_index',required=False,default=None,help='Path to hash index used with --dedup, so files are not re-hashed on later runs (default: <output>/.flexmetr_hash_index.tsv)')
+
 argparser.add_argument('--metadata_file',required=False,default=None,help='Path to custom metdata file')
 argparser.add_argument('--metadata_file_sep',required=False,default='\t',help='Separator to use in custom metadata file [default: tab]')
 argparser.add_argument('--metadata_file_accession',required=False,default='\t',help='Column in custom metadata file that holds the accession number [default: first/0]')
@@ -31,19 +45,73 @@ args = argparser.parse_args()
 input_dir = args.input
 output_dir = args.output
 
-metadata_db = args.database
+# metadata_db = args.database # not implemented yet (see -d/--database above)
 
 select_column = args.select_column
 select_values_raw = args.select_values
 
 group_by = args.group_by
 
+max_per_group = args.max_per_group
+if max_per_group != None and max_per_group < 1:
+    argparser.error('--max_per_group must be at least 1, got '+str(max_per_group))
+sample_seed = args.sample_seed
+sample_sort_column = args.sample_sort_column
+sample_sort_ascending = args.sample_sort_ascending
+
+archive_format = args.archive
+threads = args.threads
+
+dedup = args.dedup
+dedup_index_path = args.dedup_index
+
 metadata_file = args.metadata_file
 metadata_file_sep = args.metadata_file_sep
 metadata_file_accession = args.metadata_file_accession
 #/
 ###/
 
+##### FUNCTIONS
+def write_group_archive(archive_path,group_by_val,file_paths,archive_format,files_hashes=None):
+    ## Writes all files of a group into one archive, streamed sequentially. Members are stored as <group>/<basename>.
+    ## If files_hashes is given (file_path -> digest), tar-archives store files with duplicated content as hardlink members.
+    if archive_format == 'zip':
+        import zipfile
+        with zipfile.ZipFile(archive_path,'w',compression=zipfile.ZIP_DEFLATED) as archive:
+            for file_path in file_paths:
+                archive.write(file_path,arcname=group_by_val+'/'+os.path.basename(file_path))
+    else:
+        import tarfile
+        tar_mode = 'w|gz' if archive_format == 'tar.gz' else 'w|' # stream-mode, no seeking in the output
+        digests_arcnames = {} # digest -> first member with this content
+        with tarfile.open(archive_path,tar_mode) as archive:
+            for file_path in file_paths:
+                arcname = group_by_val+'/'+os.path.basename(file_path)
+                # check if content was already added, then add a hardlink member
+                if files_hashes != None and files_hashes[file_path] in digests_arcnames:
+                    tarinfo = archive.gettarinfo(file_path,arcname=arcname)
+                    tarinfo.type = tarfile.LNKTYPE
+                    tarinfo.linkname = digests_arcnames[files_hashes[file_path]]
+                    tarinfo.size = 0
+                    archive.addfile(tarinfo)
+                    continue
+                #/
+                archive.add(file_path,arcname=arcname)
+                if files_hashes != None:        digests_arcnames[files_hashes[file_path]] = arcname
+    return archive_path
+
+def get_sample_sort_score(metadata,sort_column,ascending=False):
+    ## Returns the score used to rank a genome with --sample_sort_column (highest score is selected first).
+    ## Missing or non-numeric values are ranked last.
+    try:
+        value = float(metadata[sort_column])
+    except (KeyError,ValueError):
+        return float('-inf')
+    if ascending:
+        return -value
+    return value
+#####/
+
 ## Parse select_values
 select_values = select_values_raw.split(',')
 # remove preceding spaces
@@ -79,7 +147,8 @@ if input_dir == 'db:file_path':
 # Case2: Find files in a local directory (user does not use the paths in the DB)
 if input_dir != 'db:file_path':
     for path,dirs,files in os.walk(input_dir):
-        for file_ in files:
+        dirs.sort() # traverse in sorted order, so the order of accessions (and sampling with --max_per_group) is reproducible
+        for file_ in sorted(files):
             # parse accession number from file (files without accession number will return None)
             file_accession_number = global_functions.getAccessions(file_,return_first=True,suppress_warning=True)
             #/
@@ -102,29 +171,106 @@ if input_dir != 'db:file_path':
 
 ## Organize output
 accessions_organized = {}
-for accession in input_accessions_paths:
-    metadata = accession_metadata[accession]
-    group_by_val = metadata[group_by]
-    if not group_by_val in accessions_organized:        accessions_organized[group_by_val] = []
-    accessions_organized[group_by_val].append(accession)
+if max_per_group == None:
+    for accession in input_accessions_paths:
+        metadata = accession_metadata[accession]
+        group_by_val = metadata[group_by]
+        if not group_by_val in accessions_organized:        accessions_organized[group_by_val] = []
+        accessions_organized[group_by_val].append(accession)
+# Check if select at most N genomes per group (one pass, keep at most N genomes per group in memory)
+else:
+    groups_selected = {} # group_by_val -> [[score/sample_key,input_order,accession], ...]
+    groups_num_seen = {} # group_by_val -> number of accessions seen
+    groups_rngs = {} # group_by_val -> random generator seeded by sample_seed and group, so a group's selection does not depend on other groups
+    for input_order,accession in enumerate(input_accessions_paths):
+        metadata = accession_metadata[accession]
+        group_by_val = metadata[group_by]
+        if not group_by_val in groups_selected:
+            groups_selected[group_by_val] = []
+            groups_num_seen[group_by_val] = 0
+            groups_rngs[group_by_val] = random.Random(str(sample_seed)+':'+group_by_val)
+        groups_num_seen[group_by_val] += 1
+        selected = groups_selected[group_by_val]
+        # select by sort column: keep the N highest scores in a min-heap (ties are won by the first seen accession)
+        if sample_sort_column:
+            entry = [get_sample_sort_score(metadata,sample_sort_column,ascending=sample_sort_ascending),-input_order,accession]
+            if len(selected) < max_per_group:
+                heapq.heappush(selected,entry)
+            elif entry > selected[0]:
+                heapq.heapreplace(selected,entry)
+        #/
+        # else, seeded reservoir sampling
+        else:
+            if len(selected) < max_per_group:
+                selected.append([None,input_order,accession])
+            else:
+                replace_idx = groups_rngs[group_by_val].randrange(groups_num_seen[group_by_val])
+                if replace_idx < max_per_group:
+                    selected[replace_idx] = [None,input_order,accession]
+        #/
+    # save selected accessions in input order (input order is negated in the sort-column heap, hence abs)
+    for group_by_val,selected in groups_selected.items():
+        accessions_organized[group_by_val] = [accession for _,_,accession in sorted(selected,key=lambda x: abs(x[1]))]
+        print('Selected N='+str(len(selected))+' of '+str(groups_num_seen[group_by_val])+' genomes for group: '+group_by_val)
+    #/
+#/
 ##/
 
-## Make directory for outputs and copy-in files
-for group_by_val,accessions in accessions_organized.items():
-    # define output dir for current group
-    tmp_out = output_dir+'/'+group_by_val
-    #/
-    # check if previous dir exist, we do not expect this
-    if os.path.exists(tmp_out):
-        sys.exit('Warning: Output directory already exists! Please remove it before proceeding: '+tmp_out)
+## Check if hash input files to deduplicate content
+files_hashes = None
+if dedup:
+    if dedup_index_path == None:
+        if not os.path.exists(output_dir):      os.makedirs(output_dir)
+        dedup_index_path = output_dir+'/'+'.flexmetr_hash_index.tsv'
+    files_paths_to_hash = [input_accessions_paths[accession] for accessions in accessions_organized.values() for accession in accessions]
+    files_hashes = global_functions.get_files_hashes(files_paths_to_hash,index_path=dedup_index_path,threads=threads)
+    print('Hashed input files, N='+str(len(files_hashes))+', unique contents N='+str(len(set(files_hashes.values()))))
+##/
+
+## Check if write each group into an archive
+if archive_format:
+    # define output archive for each group
+    groups_archive_paths = {} # group_by_val -> archive path
+    for group_by_val in accessions_organized:
+        groups_archive_paths[group_by_val] = output_dir+'/'+group_by_val+'.'+archive_format
     #/
-    # make the dir
-    os.makedirs(tmp_out)
+    # check if previous archives exist, we do not expect this (check all before writing anything)
+    for archive_path in groups_archive_paths.values():
+        if os.path.exists(archive_path):
+            sys.exit('Warning: Output archive already exists! Please remove it before proceeding: '+archive_path)
+    if not os.path.exists(output_dir):      os.makedirs(output_dir)
     #/
-    # copy-in the files
-    for accession in accessions:
-        file_path = input_accessions_paths[accession]
-        file_basename = os.path.basename(file_path)
-        shutil.copy2(file_path,tmp_out+'/'+file_basename)
+    # write archives, one group per worker
+    with ThreadPoolExecutor(max_workers=max(1,threads)) as executor:
+        jobs = []
+        for group_by_val,accessions in accessions_organized.items():
+            file_paths = [input_accessions_paths[accession] for accession in accessions]
+            jobs.append(executor.submit(write_group_archive,groups_archive_paths[group_by_val],group_by_val,file_paths,archive_format,files_hashes))
+        for job in jobs:
+            print('Wrote archive: '+job.result())
     #/
+##/
+## Else, make directory for outputs and copy-in files
+else:
+    digests_targets = {} # digest -> first copied file with this content (used with --dedup)
+    for group_by_val,accessions in accessions_organized.items():
+        # define output dir for current group
+        tmp_out = output_dir+'/'+group_by_val
+        #/
+        # check if previous dir exist, we do not expect this
+        if os.path.exists(tmp_out):
+            sys.exit('Warning: Output directory already exists! Please remove it before proceeding: '+tmp_out)
+        #/
+        # make the dir
+        os.makedirs(tmp_out)
+        #/
+        # copy-in the files
+        for accession in accessions:
+            file_path = input_accessions_paths[accession]
+            file_basename = os.path.basename(file_path)
+            if files_hashes != None:
+                global_functions.copy_file_deduplicated(file_path,tmp_out+'/'+file_basename,files_hashes[file_path],digests_targets)
+            else:
+                shutil.copy2(file_path,tmp_out+'/'+file_basename)
+        #/
 ##/
\ No newline at end of file
@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
 
-import os
 import sys
 import argparse
-try:            import ete3
-except:         sys.exit('Unable to import ETE3 package. Please make sure it has been installed.')
-
+import bisect
 
 import global_functions
+import tree_core
 
 ### Parse input arguments
 # setup
@@ -22,6 +20,11 @@ argparser.add_argument('-c','--column','--col','-col','--columns','--cols','-col
 argparser.add_argument('--debranch',required=False,type=float,default=None,help='Cuts branches below input distance (default: None)')
 
 argparser.add_argument('--collapse',required=False,action='store_true',default=None,help='If specified, will collapse datasets at the same branch and select the dataset with shortest distance')
+argparser.add_argument('--collapse_select',required=False,default='dist',choices=('dist','column'),help='How to select the dataset to keep with --collapse: shortest distance (dist) or highest value in --collapse_select_column (column) (default: dist)')
+argparser.add_argument('--collapse_select_column',required=False,default=None,help='Column in metadata with e.g. a quality score, used with --collapse_select column')
+argparser.add_argument('--collapse_map',required=False,default=None,help='If specified with a path, will write the kept dataset for every collapsed dataset as a genome-map (same format as tree2.py --flextaxd_additional_genomes)')
+
+argparser.add_argument('--tree_cache_dir',required=False,default=None,help='If specified with a path, will cache the parsed tree there (keyed by the tree content) and load it from there on repeated runs (default: not set)')
 
 argparser.add_argument('--metadata_file',required=False,default=None,help='Path to custom metdata file')
 argparser.add_argument('--metadata_file_sep',required=False,default='\t',help='Separator to use in custom metadata file [default: tab]')
@@ -34,12 +37,16 @@ args = argparser.parse_args()
 
 input_file = args.input
 output_file = args.output
+tree_cache_dir = args.tree_cache_dir
 
-metadata_db = args.database
+# metadata_db = args.database # not implemented yet (see -d/--database above)
 db_columns = args.column
 
 debranch_thresh = args.debranch
 collapse_leafs = args.collapse
+collapse_select = args.collapse_select
+collapse_select_column = args.collapse_select_column
+collapse_map_path = args.collapse_map
 
 metadata_file = args.metadata_file
 metadata_file_sep = args.metadata_file_sep
@@ -49,97 +56,223 @@ format_names = args.IDE_format_names
 #/
 ###/
 
+##### FUNCTIONS
+def debranch_tree(tree,debranch_thresh):
+    ## Re-positions every leaf-node at its closest ancestor with a distance greater than debranch_thresh (or at the root,
+    ## if no ancestor is that distant). Distances to root are summed in one preorder pass and the ancestor is found by
+    ## binary search along the root path of the leaf, as distances to root increase from the root towards the leaf.
+    parent = tree.parent.tolist()
+    dist = tree.dist.tolist()
+    path_nodes = [] # root -> ... -> parent of current node
+    path_dists = [] # distance to root of each node in path_nodes
+    nodes_depths = {0:0}
+    nodes_root_dists = {0:0.0}
+    leafs_moves = [] # [[depth,preorder index,leaf,new_ancestor,new_dist], ...]
+    unsorted_warned = False
+    for preorder_idx,node in enumerate(tree.preorder()):
+        if node != 0:
+            nodes_depths[node] = nodes_depths[parent[node]] + 1
+            nodes_root_dists[node] = nodes_root_dists[parent[node]] + dist[node]
+        depth = nodes_depths[node]
+        root_dist = nodes_root_dists[node]
+        # trim path to the parent of current node
+        del path_nodes[depth:]
+        del path_dists[depth:]
+        #/
+        if tree.is_leaf(node):
+            if depth == 0: continue # single-node tree
+            # Find the ancestor with acceptable distance: the last ancestor (root->leaf) where root_dist - ancestor_dist > debranch_thresh
+            ancestor_idx = max(0,bisect.bisect_left(path_dists,root_dist-debranch_thresh) - 1)
+            new_ancestor = path_nodes[ancestor_idx]
+            #/
+            if new_ancestor != parent[node]:
+                leafs_moves.append([depth,preorder_idx,node,new_ancestor,root_dist-path_dists[ancestor_idx]])
+            continue
+        # check so ancestors are always sorted by distance (negative branch lengths break the binary search)
+        if path_dists and root_dist < path_dists[-1] and not unsorted_warned:
+            print('Warning: Found negative branch length, ancestors are not sorted by distance!')
+            unsorted_warned = True
+        #/
+        path_nodes.append(node)
+        path_dists.append(root_dist)
+    
+    # Set leafs at new ancestors (rebuild children of old parents and new ancestors once). Leafs are appended in
+    # level order (by depth, then preorder within a level), the order in which the former ete3 traversal moved them
+    leafs_moves.sort()
+    moved_leafs = set()
+    ancestors_added_leafs = {} # new ancestor -> leafs to append as children
+    for _,_,leaf,new_ancestor,new_dist in leafs_moves:
+        moved_leafs.add(leaf)
+        if not new_ancestor in ancestors_added_leafs:       ancestors_added_leafs[new_ancestor] = []
+        ancestors_added_leafs[new_ancestor].append(leaf)
+        tree.dist[leaf] = new_dist
+    nodes_new_children = {} # collect all children lists before relinking any of them
+    for node in set(parent[leaf] for leaf in moved_leafs).union(ancestors_added_leafs):
+        children = [child for child in tree.get_children(node) if not child in moved_leafs]
+        nodes_new_children[node] = children + ancestors_added_leafs.get(node,[])
+    for node,children in nodes_new_children.items():
+        tree.set_children(node,children)
+    #/
+
+def prune_dead_and_unary_nodes(tree):
+    ## Single post-order pass that deletes dead branches (branch-nodes left without children and name) and splices out
+    ## branch-nodes with a single child. The child is lifted to the grandparent with the summed branch length.
+    ## Each node is visited once and each children list is rebuilt once.
+    ## Lifted nodes are appended after the other children, in the order the former ete3 loops moved them: first the
+    ## children of single-connected branch-nodes in level order, then the children left alone by deleted dead branches.
+    nodes_lift_keys = {} # node -> [lifted by dead branch deletion,depth,preorder index]
+    nodes_depths = {0:0}
+    for preorder_idx,node in enumerate(tree.preorder()):
+        if node == 0: continue
+        node_parent = int(tree.parent[node])
+        nodes_depths[node] = nodes_depths[node_parent] + 1
+        parent_single_connected = tree.first_child[node_parent] == node and tree.next_sibling[node] == -1
+        nodes_lift_keys[node] = [not parent_single_connected,nodes_depths[node],preorder_idx]
+    for node in list(tree.postorder()):
+        if tree.is_leaf(node): continue
+        new_children = []
+        lifted_children = []
+        for child in tree.get_children(node):
+            # skip dead branch
+            if tree.is_leaf(child) and not tree.name_ids[child]: continue
+            #/
+            # lift single child of child (the child has already been processed, so its child is not single-connected)
+            grandchildren = tree.get_children(child)
+            if len(grandchildren) == 1:
+                grandchild = grandchildren[0]
+                tree.dist[grandchild] += tree.dist[child]
+                lifted_children.append(grandchild)
+                continue
+            #/
+            new_children.append(child)
+        lifted_children.sort(key=lambda x: nodes_lift_keys[x])
+        tree.set_children(node,new_children+lifted_children)
+
+def collapse_uniform_clades(tree,get_node_classi):
+    ## Single post-order pass that merges uniform branch-nodes into their parent. A branch-node is uniform if all its
+    ## children are leaf-nodes with the same classification (get_node_classi). It is merged if the parent has no
+    ## leaf-nodes or only leaf-nodes of that classification. Its leaf-nodes are lifted to the parent (with summed branch
+    ## lengths) and the branch-node is removed. Children are finished before their parent, so a parent that became
+    ## uniform by merges is merged further upwards in the same pass.
+    ## When uniform siblings compete for a parent, they are merged in the order of the former restart-loop: first by
+    ## the round in which they would have been merged (1 + the latest round of merges into them), then by distance.
+    ## Lifted leaf-nodes are appended after the other children in that merge order, as ete3 add_child() did.
+    nodes_uniform_classi = {} # branch-node -> [classification,merge round], for uniform branch-nodes
+    for node in list(tree.postorder()):
+        if tree.is_leaf(node): continue
+        children = tree.get_children(node)
+        # get classifications of leaf-children at node
+        leaf_classis = set()
+        for child in children:
+            if tree.is_leaf(child) and tree.name_ids[child]:
+                leaf_classis.add(get_node_classi(child))
+        #/
+        # merge uniform children. Require node to have no leaf-nodes or only the classification of the merged child
+        uniform_children = [child for child in children if child in nodes_uniform_classi]
+        merged_children = set()
+        lifted_leafs = []
+        merge_round = 1
+        for child in sorted(uniform_children,key=lambda x: (nodes_uniform_classi[x][1],tree.dist[x])):
+            child_classi,child_merge_round = nodes_uniform_classi[child]
+            if leaf_classis and leaf_classis != {child_classi}: continue
+            for leaf in tree.get_children(child):
+                tree.dist[leaf] += tree.dist[child]
+                lifted_leafs.append(leaf)
+            leaf_classis.add(child_classi)
+            merged_children.add(child)
+            merge_round = max(merge_round,child_merge_round+1)
+        if merged_children:
+            children = [child for child in children if not child in merged_children] + lifted_leafs
+            tree.set_children(node,children)
+        #/
+        # check if node is uniform (all children are leaf-nodes of a single classification)
+        if len(leaf_classis) == 1 and all(tree.is_leaf(child) and tree.name_ids[child] for child in children):
+            nodes_uniform_classi[node] = [next(iter(leaf_classis)),merge_round]
+        #/
+
+def collapse_leafs_to_representatives(tree,get_node_classi=None,get_node_select_key=None):
+    ## Single post-order pass that keeps one representative leaf-node per classification (get_node_classi, or all
+    ## leaf-nodes as one group if not given) among the leaf-children of each branch-node, and detaches the rest.
+    ## The representative is the leaf-node with the lowest get_node_select_key (default: shortest distance to the
+    ## branch-node).
+    ## Branch-nodes left with a single child are removed, and the child is lifted to the parent with summed distance.
+    ## As before, only the leaf-nodes that were children of a branch-node are collapsed there (lifted leaf-nodes are not
+    ## collapsed again at their new parent).
+    ## Returns a dict: representative leaf-node -> [collapsed leaf-node names]
+    representatives = {leaf:[] for leaf in tree.leaves()}
+    for node in list(tree.postorder()):
+        if tree.is_leaf(node): continue
+        # lift single child of children (the child has already been processed). Lifted children are appended after
+        # the other children, as ete3 add_child() did in the former loop
+        new_children = []
+        lifted_children = []
+        for child in tree.get_children(node):
+            grandchildren = tree.get_children(child)
+            if len(grandchildren) == 1:
+                grandchild = grandchildren[0]
+                tree.dist[grandchild] += tree.dist[child]
+                lifted_children.append(grandchild)
+                continue
+            new_children.append(child)
+        new_children += lifted_children
+        lifted_children = set(lifted_children)
+        #/
+        # sort leaf-children by classification (use default classification "None" if no metadata)
+        childrens_classified = {}
+        for child in new_children:
+            if tree.is_leaf(child) and not child in lifted_children:
+                classi = None
+                if get_node_classi != None:
+                    classi = get_node_classi(child)
+                if not classi in childrens_classified:      childrens_classified[classi] = []
+                childrens_classified[classi].append(child)
+        #/
+        # for each classification of leaf-children, keep the representative only
+        discarded_children = set()
+        for classi,leaf_childs in childrens_classified.items():
+            if len(leaf_childs) < 2: continue
+            # determine which child to keep
+            if get_node_select_key != None:
+                best_child = min(leaf_childs,key=get_node_select_key)
+            else:
+                best_child = min(leaf_childs,key=lambda x: tree.dist[x])
+            #/
+            # save collapsed information at the kept child
+            for child in leaf_childs:
+                if child == best_child: continue
+                del representatives[child]
+                representatives[best_child].append(tree.name(child))
+                discarded_children.add(child)
+            #/
+        #/
+        tree.set_children(node,[child for child in new_children if not child in discarded_children])
+    #/
+    return representatives
+#####/
+
 ## Parse metadata from custom file
 if metadata_file:
     accession_metadata = global_functions.parse_metadata_file(metadata_file)
 ##/
 
-## Read input (stdin or file)
-if input_file == '-':
-    input_string = sys.stdin.read()
-else:
-    with open(input_file,'r') as f:
-        input_string = f.read()
-input_string = input_string.strip('\n')
-##/
-
-## Parse input into ete3 tree structure
-tree = ete3.Tree(input_string)
-
-if 0 and 'IDE, set root':
-    try:
-        root_name = 'GCF_003697165.2'
-        print('[IDE] Attempting to set root: '+root_name)
-        root_node = tree.search_nodes(name=root_name)[0]
-        tree.set_outgroup(root_node)
-    except:
-        print('[IDE] Failed to set root')
+## Parse input into array-backed tree, algorithms below run on it (nodes without distance get 1.0, as in ete3)
+tree = None
+if tree_cache_dir:
+    tree_cache_path,input_file = tree_core.get_tree_cache_path(input_file,tree_cache_dir,options={'default_dist':1.0})
+    tree_cache = tree_core.load_tree_cache(tree_cache_path)
+    if tree_cache:      tree = tree_cache[0]
+if tree == None:
+    tree = tree_core.read_newick(input_file,default_dist=1.0)
+    if tree_cache_dir:      tree_core.save_tree_cache(tree_cache_path,tree)
 ##/
 
 ## Check if debranch branches below certain threshold
 if debranch_thresh:
     # For every leaf-node, calculate distance to parent branch-nodes and re-position them at user-specified cutoff
-    for node in tree.traverse():
-        if node.is_leaf():
-            # Get ancestors to node
-            ancestors = node.get_ancestors()
-            #/
-            
-            # IDE: check so ancestors are always sorted by distance
-            ancestors_dist = [node.get_distance(ancestor) for ancestor in ancestors]
-            if not ancestors_dist == sorted(ancestors_dist): print('IDE: Ancestors were not sorted by distance!')
-            #/
-            
-            # Find the ancestor with acceptable distance: Check if distance to this ancestor is greater than the user-specified cutoff
-            new_ancestor = None
-            for ancestor in ancestors:
-                leaf_ancestor_dist = node.get_distance(ancestor)
-                
-                
-                if leaf_ancestor_dist > debranch_thresh:
-                    new_ancestor = ancestor
-                    break
-            #/
-            
-            # Set node at new ancestor
-            if new_ancestor != node._up:
-                new_ancestor_dist = node.get_distance(new_ancestor)
-                node.detach()
-                new_ancestor.add_child(node)
-                node.dist = new_ancestor_dist
-            #/
-    #/
-    # Join branch-nodes that are single-connected
-    for node in tree.traverse():
-        # Get ancestors to node
-        ancestors = node.get_ancestors()
-        #/
-        # Lift node to first ancestor that have at least two children
-        new_ancestor = None
-        for ancestor in ancestors:
-            num_children = len(ancestor.get_children())
-            if num_children >= 2:
-                new_ancestor = ancestor
-                break
-        
-        if new_ancestor != node._up:
-            new_ancestor_dist = node.get_distance(new_ancestor)
-            node.detach()
-            new_ancestor.add_child(node)
-            node.dist = new_ancestor_dist
-        #/
+    debranch_tree(tree,debranch_thresh)
     #/
-    # Clean tree from dead branches (branch-nodes with no leaf-nodes of datasets)
-    iterations = 0
-    deletion_made = False
-    while iterations < 1000000 and (deletion_made or iterations == 0):
-        deletion_made = False
-        for node in tree.traverse():
-            if len(node.get_children()) == 0 and not node.name:
-                node.delete()
-                deletion_made = True
-                break
-        iterations += 1
+    # Join branch-nodes that are single-connected and clean tree from dead branches (branch-nodes with no leaf-nodes of datasets)
+    prune_dead_and_unary_nodes(tree)
     #/
 ##/
 ## Check if debranch based on database column
@@ -147,8 +280,8 @@ accession_metadata = None
 if db_columns:
     ## Get accessions to import from DB
     accessions_to_import = set()
-    for node in tree.traverse():
-        name = node.name
+    for node in tree.preorder():
+        name = tree.name(node)
         if name:
             accession = global_functions.getAccessions(name,return_first=True)
             
@@ -174,167 +307,87 @@ if db_columns:
         accession_metadata = global_functions.parse_metadata_file(metadata_file,accessions_to_import=accessions_to_import,cols_to_import=cols_to_import)
     ##/
     
+    nodes_classis = {} # leaf-node -> classification
     def get_node_classi(inp_node):
-        name = inp_node.name
-        accession = global_functions.getAccessions(name,return_first=True)
-        
-        # Save leaf-classifications at node
-        vals = []
-        for db_key in db_keys:
-            value = accession_metadata[accession][db_key]
-            if not value:
-                value = 'NA'
-            vals.append(value)
+        # Parse accession and classification once per leaf-node. Later calls use the cached values
+        if not inp_node in nodes_classis:
+            name = tree.name(inp_node)
+            accession = global_functions.getAccessions(name,return_first=True)
+            
+            # Save leaf-classifications
+            vals = []
+            for db_key in db_keys:
+                value = accession_metadata[accession][db_key]
+                if not value:
+                    value = 'NA'
+                vals.append(value)
             
-        vals_ID = '||'.join(map(str,vals))
+            nodes_classis[inp_node] = tuple(vals)
+            #/
         
-        return vals_ID
-    
-    def get_node_children_classis_counts(inp_node):
-        leafClassis_counts = {}
-        childrens = inp_node.get_children()
-        for child in childrens:
-            if child.is_leaf() and child.name:
-                name = child.name
-                accession = global_functions.getAccessions(name,return_first=True)
-                
-                child_classi_ID = get_node_classi(child)
-                if not child_classi_ID  in leafClassis_counts:     leafClassis_counts[child_classi_ID] = set()
-                leafClassis_counts[child_classi_ID].add(accession)
-                
-        return leafClassis_counts
+        return nodes_classis[inp_node]
     
     # For each branch-node, raise its children if all leaf-nodes have the same classification
-    iterations = 0
-    deletion_made = False
-    del_nodes = []
-    while iterations < 1000000 and (deletion_made or iterations == 0):
-        deletion_made = False
-        for node in sorted(tree.traverse(),key=lambda x: x.get_distance(root_node)):
-            if not node.is_leaf():
-                # count the number of leaf-nodes per classification
-                leafClassis_counts = get_node_children_classis_counts(node)
-                #/
-                # Sort children (datasets + branches) and leaf-children (datasets)
-                childrens = node.get_children()
-                childrens_leafs = []
-                for child in childrens:
-                    if child.is_leaf() and child.name:
-                        childrens_leafs.append(child)
-                #/
-                # Check if only one classificaiton exist at node, if so then reposition leaf-nodes at parent
-                if len(leafClassis_counts) == 1 and childrens == childrens_leafs:
-                    delete_node = False
-                    for child in childrens:
-                        
-                        if 0 :
-                            ## IDE
-                            name = child.name
-                            accession = global_functions.getAccessions(name,return_first=True)
-                            fam,gen,spe,accn = accession_metadata[accession]['family'],accession_metadata[accession]['genus'],accession_metadata[accession]['species'],accession
-                            child_name = fam+'_'+gen+'_'+spe+'_'+accn
-                            if child_name in ('Francisellaceae_Francisella_tularensis_GCA_000018925.1','Burkholderiaceae_Burkholderia_gladioli-A_GCA_009911875.1',):
-                                sys.exit(child_name)
-                            ##/
-                            
-                        parent = node._up
-                        if parent:
-                            # Check so there is not a conflict in classification at parent
-                            parent_child_classis_counts = get_node_children_classis_counts(parent)
-                            #/
-                            # Require upstream node to have only same classifications as current node (leaf+branch), or no classifications at all (branch+branch)
-                            if (parent_child_classis_counts.keys() == leafClassis_counts.keys()) or not parent_child_classis_counts:
-                                
-                                node_child_dist = node.get_distance(child)
-                                node_parent_dist = node.get_distance(parent)
-                                child_parent_dist = node_child_dist + node_parent_dist
-                                
-                                child.detach()
-                                parent.add_child(child)
-                                child.dist = child_parent_dist
-                                delete_node = True # must delete node after repositioning all childs
-                    
-                    if delete_node:
-                        node.delete()
-                        deletion_made = True # toggle to restart while-loop
-            #/
-        iterations += 1
+    collapse_uniform_clades(tree,get_node_classi)
     #/
 ##/
 
 ## Check if reduce >2 leaf's to top2 (based on distance) leaf
+representatives = None
 if collapse_leafs:
-    collapsed_childs = {} # "best_child" -> "collapsed childs"
+    # Check if we have metadata from DB imported. Else use default classification as "None"
+    get_node_classi_collapse = None
+    if accession_metadata:
+        get_node_classi_collapse = get_node_classi
+    #/
+    # Check if user wants to select the kept dataset by a metadata column, then import it
+    if collapse_select == 'column':
+        if not (metadata_file and collapse_select_column):
+            sys.exit('Error: --collapse_select column requires --metadata_file and --collapse_select_column')
+        select_metadata = global_functions.parse_metadata_file(metadata_file,cols_to_import={collapse_select_column})
+    
+    def get_node_column_key(inp_node):
+        # Highest value in column is kept (ties: shortest distance). Missing or non-numeric values are selected last
+        accession = global_functions.getAccessions(tree.name(inp_node),return_first=True,suppress_warning=True)
+        try:
+            value = float(select_metadata[accession][collapse_select_column])
+        except (KeyError,ValueError):
+            value = float('-inf')
+        return (-value,tree.dist[inp_node])
+    
+    def get_node_dist_key(inp_node):
+        # Shortest distance is kept
+        return tree.dist[inp_node]
+    
+    get_node_select_key = get_node_column_key if collapse_select == 'column' else get_node_dist_key
+    #/
     # Find branch-nodes with >1 leafs and select best leaf
-    for node in tree.traverse():
-        if not node.is_leaf():
-            # get all childrens (leafs + branches)
-            childrens = node.get_children()
-            #/
-            
-            # sort leaf-childrens by classification
-            childrens_classified = {}
-            for child in childrens:
-                if child.is_leaf() and len(child.get_children()) == 0:
-                    # Check if we have metadata from DB imported. Else use default classification as "None"
-                    if accession_metadata:
-                        classi = get_node_classi(child)
-                    else:
-                        classi = None
-                    #/
-                    if not classi in childrens_classified:      childrens_classified[classi] = []
-                    childrens_classified[classi].append(child)
-            #/
-            # for each classification of leafs-chindren, keep best child only
-            for classi,leaf_childs in childrens_classified.items():
-                # Check if >1 leaf-child, then select child with shortest distance to current branch-node and discard the rest
-                if len(leaf_childs) > 1:
-                    # determine which child to keep
-                    best_child = sorted(leaf_childs,key=lambda x: x.dist)[0]
-                    #/
-                    # determine which childs to remove
-                    discard_childs = []
-                    for child in leaf_childs:
-                        if not child == best_child:
-                            discard_childs.append(child)
-                    #/
-                    # execute removal
-                    for discard_child in discard_childs:
-                        discard_child.detach()
-                    #/
-                    # save collapsed information
-                    collapsed_childs[best_child.name] = [discard_child.name for discard_child in discard_childs]
-                    #/
-                #/
-            #/
-            # Check if branch now has a single orphan leaf, then move child to parent and readjust dist
-            if len(node.get_children()) == 1:
-                best_child = node.get_children()[0]
-                parent = node._up
-
-                best_child_parent_dist = parent.get_distance(best_child)
-                
-                best_child.detach()
-                parent.add_child(best_child)
-                best_child.dist = best_child_parent_dist
-                
-                node.delete()
-            #/
+    representatives = collapse_leafs_to_representatives(tree,get_node_classi=get_node_classi_collapse,get_node_select_key=get_node_select_key)
     #/
 ##/
 
-
 ## IDE: Format names
 if format_names and accession_metadata:
-    for node in tree.traverse():
-        if node.is_leaf():
-            name = node.name
-            accession = global_functions.getAccessions(name,return_first=True)
-            fam,gen,spe,mycol1,accn = accession_metadata[accession]['family'],accession_metadata[accession]['genus'],accession_metadata[accession]['species'],accession_metadata[accession]['mycol1'],accession
-            node.name = fam+'_'+gen+'_'+spe+'_'+mycol1+'_'+accn
+    for node in tree.leaves():
+        name = tree.name(node)
+        accession = global_functions.getAccessions(name,return_first=True)
+        fam,gen,spe,mycol1,accn = accession_metadata[accession]['family'],accession_metadata[accession]['genus'],accession_metadata[accession]['species'],accession_metadata[accession]['mycol1'],accession
+        tree.set_name(node,fam+'_'+gen+'_'+spe+'_'+mycol1+'_'+accn)
 ##/
 
 
-#print(tree)
-print(tree.write(format=1))
+## Check if output collapsed datasets as a genome-map (accession of every dataset -> name of kept dataset in tree)
+if collapse_map_path and representatives != None:
+    with open(collapse_map_path,'w') as nf:
+        for leaf,collapsed_names in representatives.items():
+            leaf_name = tree.name(leaf)
+            for name in [leaf_name]+collapsed_names:
+                accession = global_functions.getAccessions(name,return_first=True,suppress_warning=True)
+                if not accession:       accession = name
+                nf.write('\t'.join([accession,leaf_name])+'\n')
+##/
+
+## Write output (stdout or file)
+tree_core.write_newick(tree,output_file)
+##/
 
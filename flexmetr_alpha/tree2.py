@@ -4,18 +4,23 @@ import os
 import sys
 import re
 import argparse
-from random import randint
+import bisect
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 from matplotlib import collections
 import matplotlib.patches as patches
 
+try:            import numpy as np
+except:         sys.exit('Unable to import NumPy package. Please make sure it has been installed.')
 try:
-    from Bio import Phylo
-    from io import StringIO
+    from Bio.Phylo.BaseTree import Clade
 except:
-    sys.exit('Unable to import Biopython Phylo or StringIO package. Please make sure it has been installed.')
+    sys.exit('Unable to import Biopython Phylo package. Please make sure it has been installed.')
 
 import global_functions
+import tree_core
+import flextaxd_db
 
 ### Parse input arguments
 # setup
@@ -23,11 +28,18 @@ argparser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatte
 argparser.add_argument('-i','--input',required=True,help='Path to input file or "-" to read from stream')
 argparser.add_argument('-o','--output',required=False,default='-',help='Path to output file or "-" to print stream')
 argparser.add_argument('--plot',required=False,default=None,help='Path to output plot (default: do not output)')
+argparser.add_argument('--plot_leafs_per_page',required=False,type=int,default=None,help='If specified with a number, will split the plot into pages of this many leaf rows, written as <plot>_page<number><extension> (default: not set)')
+argparser.add_argument('--plot_svg',required=False,default=None,help='Path to output the tree with metadata as SVG, written while traversing the tree (default: do not output)')
+argparser.add_argument('--threads',required=False,type=int,default=1,help='Number of plot pages to render in parallel with --plot_leafs_per_page. Only used on Linux, pages are rendered one by one on other platforms (default: 1)')
 
 # argparser.add_argument('-d','--database','-db','--db',required=False,default='flexmetr/db.sql',help='Path to database (default:flexmetr/db.sql)') # not implemented yet
 
 argparser.add_argument('-c','--column','--col','-col','--columns','--cols','-cols',required=False,help='Column in metadata to format output. Multiple columns may be specified by comma (e.g.: family,genus,species)')
 argparser.add_argument('--branch_columns',required=False,default=None,help='Columns to use to resolve metadata for branch-nodes (default: not set)')
+argparser.add_argument('--branch_match_threshold',required=False,type=float,default=1.0,help='Minimum purity (fraction of clade datasets with the value) and completeness (fraction of datasets with the value that are in the clade) for a branch-node to get a branch metadata value. Below 1, the best-scoring clade with a branch node is used (a value of a single dataset is scored at the closest branch node above it). CanSNP "False" values (accessions without the canSNP) only match exact clades (default: 1.0, only exact clades)')
+argparser.add_argument('--concordance_report',required=False,default=None,help='If specified with a path, will write a table of how well each branch metadata value matches a clade (MRCA, purity, completeness). The annotated clade columns describe the final branch labels, also with --branch_consensus (default: not set)')
+argparser.add_argument('--branch_consensus',required=False,type=float,default=None,help='If specified with a fraction above 0.5 (e.g. 0.95), will label branch-nodes by consensus instead of exact clades: a branch column value is put at the highest branch-node where at least this fraction of the clade datasets has it (default: not set)')
+argparser.add_argument('--clade_counts',required=False,default=None,help='If specified with a path, will write the number of datasets with each branch column value for every clade. For canSNPs, datasets with the canSNP are counted (default: not set)')
 
 
 argparser.add_argument('--outgroup',required=False,default=None,help='Set outgroup name (default: not set)')
@@ -37,6 +49,8 @@ argparser.add_argument('--cansnper_column',required=False,default=None,help='If
 argparser.add_argument('--cansnps',required=False,default=None,help='If specified with a comma-separated list without spaces, will import these CanSNPs (default: not set)')
 
 argparser.add_argument('--flextaxd_outfiles_path',required=False,default=None,help='If specified with a path, will make a directory to output FlexTaxD-formatted files for arguments --taxonomy_file <treetaxonomy> --genomeid2taxid <genome_map> (default: not set)')
+argparser.add_argument('--flextaxd_database',required=False,default=None,help='If specified with a path, will write the FlexTaxD output (tree relations, ranks and genomes) directly to a FlexTaxD-schema SQLite database there. May be used without --flextaxd_outfiles_path. Without --flextaxd_root_name_linker, the top nodes of the tree are linked to "root" (default: not set)')
+argparser.add_argument('--taxdump_outfiles_path',required=False,default=None,help='If specified with a path, will make a directory to output the FlexTaxD-named tree as NCBI taxdump files (nodes.dmp, names.dmp) and a seqid2taxid.map, e.g. for Kraken2 database builds. Taxids are given in tree pre-order (root is 1) and ranks are resolved from the first --flextaxd_rank_columns column of each node. The map is headerless with two tab-separated columns: genome accession (GCx_123456789.1) and taxid. It is keyed by genome accessions, not FASTA sequence ids: for Kraken2, the sequence ids of each genome must be mapped to the accession taxid (default: not set)')
 argparser.add_argument('--flextaxd_additional_genomes',required=False,default=None,help='If specified with a path, will load additional genomes from a FlexTaxD genome-map file. For example, with redundant genomes from RepGenR. Implies --flextaxd_outfiles_path (default: not set)')
 argparser.add_argument('--flextaxd_root_name_linker',required=False,default=None,help='If specified, will add a "linker" with this name as root, connecting the target node in FlexTaxD to the imported tree (default: not set)')
 argparser.add_argument('--flextaxd_apply_downstream',required=False,action='store_true',default=None,help='If specified, will apply branch metadata to all downstream branch nodes (default: not set)')
@@ -51,6 +65,8 @@ argparser.add_argument('--leaf_node_basename',required=False,default='leaf',help
 
 argparser.add_argument('--branchify_leafs',required=False,action='store_true',default=None,help='If specified, will wedge in a branch-node upstream of leaf-nodes (default: not set)')
 
+argparser.add_argument('--tree_cache_dir',required=False,default=None,help='If specified with a path, will cache the parsed and indexed tree there (keyed by the tree content and tree-shaping arguments) and load it from there on repeated runs (default: not set)')
+
 argparser.add_argument('--metadata_file',required=False,default=None,help='Path to custom metdata file')
 argparser.add_argument('--metadata_file_sep',required=False,default='\t',help='Separator to use in custom metadata file [default: tab]')
 argparser.add_argument('--metadata_file_accession',required=False,default='\t',help='Column in custom metadata file that holds the accession number [default: first/0]')
@@ -61,10 +77,18 @@ args = argparser.parse_args()
 input_file = args.input
 output_file = args.output
 plot_output_file_path = args.plot
+plot_leafs_per_page = args.plot_leafs_per_page
+plot_svg_output_file_path = args.plot_svg
+threads = args.threads
+tree_cache_dir = args.tree_cache_dir
 
-metadata_db = args.database
+# metadata_db = args.database # not implemented yet (see -d/--database above)
 db_columns_raw = args.column
 db_columns_branches_raw = args.branch_columns
+branch_match_threshold = args.branch_match_threshold
+concordance_report_path = args.concordance_report
+branch_consensus = args.branch_consensus
+clade_counts_path = args.clade_counts
 
 outgroup_dataset = args.outgroup
 remove_outgroup = args.remove_outgroup
@@ -73,7 +97,9 @@ cansnper_column = args.cansnper_column
 cansnps_to_use = args.cansnps
 
 flextaxd_outfiles_path = args.flextaxd_outfiles_path
+flextaxd_database = args.flextaxd_database
 flextaxd_additional_genomes = args.flextaxd_additional_genomes
+taxdump_outfiles_path = args.taxdump_outfiles_path
 flextaxd_root_name_linker = args.flextaxd_root_name_linker
 flextaxd_apply_downstream = args.flextaxd_apply_downstream
 flextaxd_rank_columns = args.flextaxd_rank_columns
@@ -97,7 +123,9 @@ metadata_file_accession = args.metadata_file_accession
 def metadata_parse_canSNPer_column(metadata_dict,db_columns_to_use,cansnps_to_use):
     ## See variable descriptions in argparse
     ## Metadata_dict is the imported metadata
-    ## Returns input metadata_dict and db_columns_to_usem, now with expanded canSNPs
+    ## Returns input metadata_dict (without the CanSNPer column), db_columns_to_use with expanded canSNPs, and
+    ## cansnps_datasets: canSNP -> set of accessions that have it. Accessions in metadata_dict that are not in the set of
+    ## a canSNP do not have it ("False"), so memory grows with the number of canSNP assignments only
     
     # check if user want to parse specific canSNPs
     if cansnps_to_use != None:
@@ -106,43 +134,32 @@ def metadata_parse_canSNPer_column(metadata_dict,db_columns_to_use,cansnps_to_us
             if not cansnp_to_use in cansnps_to_use_parsed: # do not allow duplicates. Use array to maintain user input order of cansnps
                 cansnps_to_use_parsed.append(cansnp_to_use)
         cansnps_to_use = cansnps_to_use_parsed
+        cansnps_to_use_set = set(cansnps_to_use)
     #/
-    # make new columns for each canSNP
-    cansnps_parsed = set() # keep track of which cansnps were parsed and set these to "False" across samples without the cansnp
+    # save accessions of each canSNP and remove the cansnp assignment master column, in one pass
+    cansnps_datasets = {} # canSNP -> accessions with canSNP
     for accession,metadata in metadata_dict.items():
-        if cansnper_column in metadata:
-            cansnp_assignments = metadata[cansnper_column].replace('"','')
-            for cansnp_assignment in cansnp_assignments.split(';'):
-                # ensure that there is no other metadata column with this value
-                if cansnp_assignment in metadata:
-                    print(f'FATAL: When attempting to parse CanSNP assignments from column {cansnper_column} there was already a column value imported for {cansnp_assignment}. Please check your input metadata and ensure that there are no conflicts.')
-                    sys.exit()
-                #/
-                # check if user wants to use this canSNP
-                if cansnps_to_use != None and not cansnp_assignment in cansnps_to_use: continue
-                #/
-                # save canSNP as new column
-                metadata[cansnp_assignment] = True
-                #/
-                # save to tracker
-                cansnps_parsed.add(cansnp_assignment)
-                #/
+        if not cansnper_column in metadata: continue
+        cansnp_assignments = metadata.pop(cansnper_column).replace('"','')
+        for cansnp_assignment in cansnp_assignments.split(';'):
+            # ensure that there is no other metadata column with this value
+            if cansnp_assignment in metadata:
+                print(f'FATAL: When attempting to parse CanSNP assignments from column {cansnper_column} there was already a column value imported for {cansnp_assignment}. Please check your input metadata and ensure that there are no conflicts.')
+                sys.exit()
+            #/
+            # check if user wants to use this canSNP
+            if cansnps_to_use != None and not cansnp_assignment in cansnps_to_use_set: continue
+            #/
+            # save accession at canSNP
+            if not cansnp_assignment in cansnps_datasets:           cansnps_datasets[cansnp_assignment] = set()
+            cansnps_datasets[cansnp_assignment].add(accession)
+            #/
     #/
     # exit if no cansnp was found in specified column
-    if not cansnps_parsed:
+    if not cansnps_datasets:
         print(f'FATAL: No CanSNPs found in specified column {cansnper_column}. Please check the spelling and make sure that this column is imported (when using --columns parameter)')
         sys.exit()
     #/
-    # set canSNPs to "False" where not present
-    for cansnp_parsed in cansnps_parsed:
-        for accession,metadata in metadata_dict.items():
-            if not cansnp_parsed in metadata:
-                metadata[cansnp_parsed] = False
-    #/
-    # remove cansnp assignment master column
-    for accession,metadata in metadata_dict.items():
-        del metadata[cansnper_column]
-    #/
     # cleanup db_columns and add parsed cansnps while maintaining order
     db_columns_new = []
     for idx,val in enumerate(db_columns_to_use):
@@ -154,7 +171,251 @@ def metadata_parse_canSNPer_column(metadata_dict,db_columns_to_use,cansnps_to_us
     db_columns_to_use = db_columns_new
     #/
     # return
-    return metadata_dict,db_columns_to_use
+    return metadata_dict,db_columns_to_use,cansnps_datasets
+
+def get_leaf_interval(leaf_positions):
+    ## Returns the leaf order interval [lo,hi) filled by leaf_positions, or None if they do not fill one (i.e. are not a clade)
+    interval_lo,interval_hi = min(leaf_positions),max(leaf_positions)+1
+    if interval_hi-interval_lo != len(leaf_positions):      return None
+    return (interval_lo,interval_hi)
+
+def get_leaf_interval_complement(leaf_positions_sorted,excluded_leaf_positions):
+    ## Returns get_leaf_interval() of leaf_positions_sorted without excluded_leaf_positions (a subset of them). Only steps
+    ## past excluded positions at both ends, so that the cost grows with the number of excluded positions
+    num_positions = len(leaf_positions_sorted)-len(excluded_leaf_positions)
+    if num_positions == 0:      return None
+    start,end = 0,len(leaf_positions_sorted)-1
+    while leaf_positions_sorted[start] in excluded_leaf_positions:      start += 1
+    while leaf_positions_sorted[end] in excluded_leaf_positions:        end -= 1
+    interval_lo,interval_hi = leaf_positions_sorted[start],leaf_positions_sorted[end]+1
+    if interval_hi-interval_lo != num_positions:        return None
+    return (interval_lo,interval_hi)
+
+def score_value_clades(value_datasets):
+    ## Returns the MRCA of value_datasets and candidate clades as [purity,completeness,node]. Candidates are the datasets and
+    ## the LCAs of datasets adjacent in leaf order (the branching points up to the MRCA). Any other clade has the same
+    ## datasets as the candidate below it but more leaves, so it cannot score higher. A candidate without a branch node to
+    ## annotate (e.g. a leaf) is replaced by its nearest ancestor with one
+    value_nodes = sorted([names_nodes[dataset] for dataset in value_datasets])
+    value_leaf_positions = [leaf_lo[node] for node in value_nodes] # sorted as well (preorder)
+    candidate_nodes = set(value_nodes)
+    if len(value_nodes) > 1:
+        candidate_nodes.update(lca_index.lca_many(value_nodes[:-1],value_nodes[1:]).tolist())
+    mrca = lca_index.lca(value_nodes[0],value_nodes[-1])
+    candidate_nodes = set([nodes_branchClades[node] for node in candidate_nodes])
+    candidate_nodes.discard(-1)
+    
+    candidates = []
+    for node in candidate_nodes:
+        num_value_datasets = bisect.bisect_left(value_leaf_positions,leaf_hi[node]) - bisect.bisect_left(value_leaf_positions,leaf_lo[node])
+        purity = num_value_datasets / (leaf_hi[node]-leaf_lo[node])
+        completeness = num_value_datasets / len(value_nodes)
+        candidates.append([purity,completeness,node])
+    return mrca,candidates,value_leaf_positions
+
+def score_labelled_clades(column,value,value_leaf_positions):
+    ## Returns [branch nodes,clade datasets,purity,completeness] for the branch nodes finally labelled with the column value
+    ## (by clade matching or by consensus). Nested clades are counted once, with their labelled ancestor
+    labelled_nodes = sorted([names_nodes[branchnode] for branchnode in column_vals_branchnodes.get(column,{}).get(value,[])])
+    if not labelled_nodes: return ['','','','']
+    num_clade_datasets = 0
+    num_value_datasets = 0
+    covered_leaf_hi = -1
+    for node in labelled_nodes: # preorder, so a nested clade follows its ancestor
+        if leaf_lo[node] < covered_leaf_hi: continue
+        num_clade_datasets += leaf_hi[node]-leaf_lo[node]
+        num_value_datasets += bisect.bisect_left(value_leaf_positions,leaf_hi[node]) - bisect.bisect_left(value_leaf_positions,leaf_lo[node])
+        covered_leaf_hi = leaf_hi[node]
+    purity = num_value_datasets / num_clade_datasets
+    completeness = num_value_datasets / len(value_leaf_positions)
+    return [','.join([ftree.name(node) for node in labelled_nodes]),num_clade_datasets,round(purity,4),round(completeness,4)]
+
+def get_node_parent(node_name):
+    ## Returns the name of the parent of node_name, or None if the parent is the root (as in root->leaf paths)
+    node_parent = ftree_parents[names_nodes[node_name]]
+    if node_parent <= 0:        return None
+    return ftree.name(node_parent)
+    #/
+
+def draw_plot(plot_path,page_rows=None):
+    ## Draws the tree with metadata tracks and clade areas to plot_path. If page_rows is given as [first,last] leaf row
+    ## (1-based), only these rows are drawn, with text and elements scaled by the number of datasets on the page. Uses the
+    ## layout and what to draw from "Do plotting"
+    if page_rows == None:       page_rows = [1,len(leaf_order)]
+    row_first,row_last = page_rows
+    page_datasets_pos = {dataset:pos for dataset,pos in datasets_textlabel_pos.items() if row_first <= pos[1] <= row_last}
+    
+    # init figure
+    fig,(ax,ax_annotation) = plt.subplots(ncols=2, figsize=(30, 18), gridspec_kw={'width_ratios':[4,1]})
+    #/
+    # remove all stuff from ax_annotation
+    if 1:
+        for spine in ax_annotation.spines.values():
+            spine.set_visible(False)
+        ax_annotation.set_xticks([])
+        ax_annotation.set_yticks([])
+        ax_annotation.set_xticklabels([])
+        ax_annotation.set_yticklabels([])
+    #/
+    # remove space between ax and ax_annotation
+    plt.subplots_adjust(wspace=-1)
+    #/
+    # plot tree lines that are within the page rows
+    page_ymin,page_ymax = row_first-0.8,row_last+0.8
+    page_horizontal_lines = horizontal_lines[(nodes_y >= page_ymin) & (nodes_y <= page_ymax)]
+    page_vertical_lines = vertical_lines[(branch_nodes_ytop <= page_ymax) & (branch_nodes_ybot >= page_ymin)]
+    for lines in (page_horizontal_lines,page_vertical_lines):
+        ax.add_collection(collections.LineCollection(lines,color='k',lw=plt.rcParams['lines.linewidth'],capstyle='round',joinstyle='round'))
+    ax.set_xlim(-0.05*nodes_x.max(),1.25*nodes_x.max())
+    ax.set_ylim(page_ymax,page_ymin) # origin at the top
+    #/
+    
+    #@@@@@@@ SECTION: apply metadata visualisations
+    
+    ## determine scale to use for plotting (text and elements)
+    orig_font_size = plt.rcParams['font.size']
+    plot_scaler = 1
+    if 1:
+        if len(page_datasets_pos) > 200:
+            plot_scaler = 0.3
+        elif len(page_datasets_pos) > 100:
+            plot_scaler = 0.35
+        elif len(page_datasets_pos) > 50:
+            plot_scaler = 0.4
+        elif len(page_datasets_pos) > 40:
+            plot_scaler = 0.6
+        elif len(page_datasets_pos) > 30:
+            plot_scaler = 0.8
+        elif len(page_datasets_pos) > 20:
+            plot_scaler = 0.9
+    ##/
+    
+    ## Do plotting in annotation-axes
+    # init-plot invisible line to create axes boundaries
+    ax_annotation.plot([0,0],ax.get_ylim(),alpha=0)
+    #/
+    # init xoffset and set step size
+    x_offset = 1*(plot_scaler**2)
+    x_offset_init = x_offset
+    x_offset_steps = 2*plot_scaler # increase offset by this step size
+    #/
+    #@ plot dots for metadata values (all dots of a column as one scatter)
+    for tmp_label,datasets_colors in plot_tracks:
+        datasets_ycoords = []
+        dots_colors = []
+        for dataset,tmp_color in datasets_colors.items():
+            if not dataset in page_datasets_pos: continue
+            datasets_ycoords.append(page_datasets_pos[dataset][1])
+            dots_colors.append(tmp_color)
+        if datasets_ycoords:
+            ax_annotation.scatter([x_offset]*len(datasets_ycoords),datasets_ycoords,color=dots_colors,s=100*(plot_scaler**2))
+            # write label
+            ax_annotation.text(x_offset,min(datasets_ycoords)-1,tmp_label,rotation=45,fontsize=orig_font_size*plot_scaler)
+            #/
+        x_offset += x_offset_steps # for each column, increase x_offset for next column/thing to plot
+    #@/
+    # plot dataset labels
+    for dataset,textlabel_pos in page_datasets_pos.items():
+        ax_annotation.text(x_offset,textlabel_pos[1],dataset,fontsize=orig_font_size*plot_scaler)
+    x_offset += x_offset_steps
+    #/
+    ##/
+    
+    ## Try to make visual guidelines for datasets<->leafnode connection
+    # for each dataset, get position of text label and parent branch node. Use these coordinates to draw visual guideline
+    # (the guidelines of each axes are drawn as one line collection)
+    ax_guidelines = []
+    ax_annotation_guidelines = []
+    ax_guidelines_xend = ax.get_xlim()[1]
+    for dataset in page_datasets_pos:
+        # get position of textlabel for dataset (look in "repositioned" first, then in "original". This makes sense for when the outgroup is not repositioned.)
+        textlabel_pos = [0,0]
+        if dataset in datasets_textlabel_pos_repositioned:
+            textlabel_pos = datasets_textlabel_pos_repositioned[dataset]
+        else:
+            textlabel_pos = datasets_textlabel_pos[dataset]
+        #/
+        # get parent branchnode
+        dataset_parent = get_node_parent(dataset)
+        #/
+        # get parent branchnode position
+        branchlabel_pos = [0,0] # the dataset with no parent will being in 0,0
+        if dataset_parent != None:
+            branchlabel_pos = branchnode_textlabel_pos[dataset_parent] # update position if dataset had a parent
+        #/
+        # save guideline
+        ax_guidelines.append([(branchlabel_pos[0],textlabel_pos[1]),(ax_guidelines_xend,textlabel_pos[1])]) # from branchnode to max X value
+        ax_annotation_guidelines.append([(x_offset_init,textlabel_pos[1]),(x_offset-x_offset_steps,textlabel_pos[1])]) # from xlim start to last used x_offset, at branch_label y value
+        #/
+    #/
+    # draw guidelines
+    ax.add_collection(collections.LineCollection(ax_guidelines,color='grey',linestyle=':',alpha=0.3,zorder=0))
+    ax_annotation.add_collection(collections.LineCollection(ax_annotation_guidelines,color='grey',linestyle=':',alpha=0.3,zorder=0))
+    #/
+    ##/
+    
+    ## Do area-plotting in left axes (areas are drawn as one patch collection)
+    area_rects = []
+    area_rects_colors = []
+    branch_nodes_numTexts = {} # keep track of texts at each branchnode to offset them when multiple texts are plotted
+    for branch_node,area_color,text_to_plot in plot_areas:
+        # get dataset rows of clade, skip if not on page
+        area_ystart = max(leaf_lo[branch_node]+1,row_first)
+        area_yend = min(leaf_hi[branch_node],row_last)
+        if area_ystart > area_yend: continue
+        #/
+        # get branch node x coord (use plot right border/xlim as xend)
+        area_xstart = nodes_x[branch_node]
+        area_xend = ax.get_xlim()[1]
+        #/
+        # plot area
+        tmp_height = area_yend-area_ystart
+        tmp_width = area_xend-area_xstart
+        
+        area_rects.append(patches.Rectangle((area_xstart,area_yend), tmp_width, -tmp_height)) # x,y is bottom left of rectangle. next x2 numbers are width and height
+        area_rects_colors.append(area_color)
+        #/
+        ## add text
+        # get offset/init offset/iterate offset
+        if not branch_node in branch_nodes_numTexts:            branch_nodes_numTexts[branch_node] = 0
+        text_x_offset = branch_nodes_numTexts[branch_node]
+        branch_nodes_numTexts[branch_node] += 1
+        #/
+        # determine coords for text
+        text_x = area_xstart + (area_xend-area_xstart)*(0.1*(1+text_x_offset))
+        text_y = (area_yend+area_ystart)/2
+        #/
+        # do text-plot
+        ax.text(text_x,text_y,text_to_plot,fontsize=orig_font_size*(plot_scaler*4),color='black')
+        #/
+        ##/
+    ax.add_collection(collections.PatchCollection(area_rects,facecolors=area_rects_colors,edgecolors='none',linewidths=0,alpha=0.3))
+    ##/
+    
+    
+    #@@@@@@@/
+    
+    ## cleanup plot
+    # cleanup display
+    ax.spines['right'].set_visible(False) # remove right plot border
+    ax.spines['top'].set_visible(False) # remove top plot border
+    ax.set_xlabel(None) # remove ylabel
+    ax.set_ylabel(None) # remove ylabel
+    ax.yaxis.set_ticks([]) # remove yticks
+    #/
+    # set plot xand ylimits
+    ax.set_xlim([ax.get_xlim()[0],max([xval for xval,yval in datasets_textlabel_pos.values()])]) # use start of xcoord for furthest right dataset label as end of plot
+    
+    ax_annotation.set_xlim([0,10+x_offset])
+    ax_annotation.set_ylim(ax.get_ylim())
+    #/
+    # apply layout
+    plt.tight_layout()
+    #/
+    # Save as pdf
+    print(f'Dumping plot as PDF: {plot_path}')
+    plt.savefig(plot_path)
+    plt.close(fig)
     #/
 
 
@@ -174,90 +435,71 @@ def verify_imported_columns(expected_cols=None,imported_metadata=None,errormessa
 ### Import stuff
 print('Begin import')
 
-## Read input (stdin or file)
-if input_file == '-':
-    input_string = sys.stdin.read()
-else:
-    with open(input_file,'r') as f:
-        input_string = f.read()
-input_string = input_string.strip('\n')
+## Check if the indexed tree of an identical input (and tree-shaping arguments) is cached
+ftree = None
+tree = None # Biopython tree, only made when needed if the indexed tree was loaded from cache
+if tree_cache_dir:
+    tree_cache_options = {'branchify_leafs':bool(branchify_leafs),'branch_node_basename':branch_node_basename,
+                          'outgroup':outgroup_dataset,'remove_outgroup':bool(remove_outgroup)}
+    tree_cache_path,input_file = tree_core.get_tree_cache_path(input_file,tree_cache_dir,options=tree_cache_options)
+    tree_cache = tree_core.load_tree_cache(tree_cache_path)
+    if tree_cache:
+        ftree,ftree_indexes = tree_cache
+        leaf_order,leaf_lo,leaf_hi = ftree_indexes['leaf_order'],ftree_indexes['leaf_lo'],ftree_indexes['leaf_hi']
+        print('Loaded indexed tree from cache')
 ##/
-
-## Parse input into Biopython tree structure
-tree_fileobject = StringIO(input_string)
-tree = Phylo.read(tree_fileobject,'newick')
-##/
-## Check if user wants to branchify leaf nodes (e.g. to apply metadata at leaf-level)
-if branchify_leafs:
-    from Bio.Phylo.BaseTree import Clade
-    print('Adding branch node upstream of leaf nodes now')
+if ftree == None:
+    ## Parse input (stdin or file) into Biopython tree structure
+    tree = tree_core.read_newick(input_file).to_phylo()
+    ##/
+    ## Check if user wants to branchify leaf nodes (e.g. to apply metadata at leaf-level)
+    if branchify_leafs:
+        print('Adding branch node upstream of leaf nodes now')
     
-    # dummy-set a root to get path for highest nodes
-    dummy_root = Clade(name='dummyroot')
-    orig_root = tree.root
-    dummy_root.clades.append(orig_root)
-    tree.root = dummy_root
-    #/
-    # add branchnode upstream of leafnodes
-    for leaf_node in tree.get_terminals():
-        if leaf_node.name == 'dummyroot': continue
-        leaf_path = tree.get_path(leaf_node.name)
-        
-        # bugcheck: all leaves should have a parent. If it does not, it means it is adjacent to undefined root
-        if len(leaf_path) == 1:
+        # bugcheck: all leaves should have a parent. If the root is a leaf, there is no parent to wedge in a branch node at
+        if tree.root.is_terminal():
             print('FATAL: Expected leaf-node to have a parent but it did not! Make fix for this!')
             sys.exit()
         #/
-        # bugcheck: last node should be the leaf
-        if not leaf_node.name == leaf_path[-1].name:
-            print('FATAL: Expected last node in path to be the leaf. Make fix for this!')
-            sys.exit()
-        #/
-        # get leaf parent
-        leaf_parent = leaf_path[-2]
-        #/
-        # clear leaf from parent
-        leaf_parent.clades.remove(leaf_node)
-        #/
-        # make new branch node
-        new_branch_node = Clade(branch_length=0)
-        #/
-        # add leaf as child to new branchnode
-        new_branch_node.clades.append(leaf_node)
-        #/
-        # add new branch node under parent
-        leaf_parent.clades.append(new_branch_node)
+        # add branchnode upstream of leafnodes. Each parent's clade list is rebuilt once: branch nodes keep their order and
+        # the new branch nodes (each holding one leaf) are added after them, in leaf order
+        for leaf_parent in tree.get_nonterminals():
+            leaf_nodes = [clade for clade in leaf_parent.clades if clade.is_terminal()]
+            if not leaf_nodes: continue
+            leaf_parent.clades = [clade for clade in leaf_parent.clades if not clade.is_terminal()] + [Clade(branch_length=0,clades=[leaf_node]) for leaf_node in leaf_nodes]
         #/
-    #/
-    # when done, re-set the old root (i.e. a "no-root object". I cannot recreate this when setting tree.root = Clade(), even though orig_root is a "Clade()")
-    print('Re-setting old root')
-    tree.root = orig_root
-    #/
-##/
-## Assign branch-node names (they are empty on import)
-branch_node_enums = 0
-for branch_node in tree.get_nonterminals():
-    if branch_node.name == None or branch_node.name == '':
-        branch_node.name = branch_node_basename+str(branch_node_enums)
-        branch_node_enums += 1
-##/
-## Set outgroup (if supplied)
-if outgroup_dataset:
-    tree.root_with_outgroup(outgroup_dataset)
-##/
-## Remove outgroup (if specified)
-if remove_outgroup:
-    tree.prune(outgroup_dataset)
-##/
+    ##/
+    ## Assign branch-node names (they are empty on import)
+    branch_node_enums = 0
+    for branch_node in tree.get_nonterminals():
+        if branch_node.name == None or branch_node.name == '':
+            branch_node.name = branch_node_basename+str(branch_node_enums)
+            branch_node_enums += 1
+    ##/
+    ## Set outgroup (if supplied)
+    if outgroup_dataset:
+        tree.root_with_outgroup(outgroup_dataset)
+    ##/
+    ## Remove outgroup (if specified)
+    if remove_outgroup:
+        tree.prune(outgroup_dataset)
+    ##/
+    ## Index tree structure in an array-backed tree (node names, parents, leaf order and clade leaf intervals) for the algorithms below
+    ftree = tree_core.FlexTree.from_phylo(tree)
+    leaf_order,leaf_lo,leaf_hi = ftree.leaf_intervals()
+    ftree_indexes = {'leaf_order':leaf_order,'leaf_lo':leaf_lo,'leaf_hi':leaf_hi}
+    if tree_cache_dir:      tree_core.save_tree_cache(tree_cache_path,ftree,ftree_indexes)
+    ##/
 ## Get datasets (tree leaves)
 datasets = set()
-for leaf_node in tree.get_terminals():
-    datasets.add(leaf_node.name)
+for leaf_node in leaf_order.tolist():
+    datasets.add(ftree.name(leaf_node))
 ##/
 ## Get branch node names of tree
 branchnodes_names = set() # keep track of branch nodes
-for branch_node in tree.get_nonterminals():
-    branchnodes_names.add(branch_node.name)
+for branch_node in ftree.preorder():
+    if not ftree.is_leaf(branch_node):
+        branchnodes_names.add(ftree.name(branch_node))
 ##/
 ## Parse metadata from custom file
 # parse columns
@@ -301,51 +543,25 @@ verify_imported_columns(expected_cols=db_columns_branches,imported_metadata=bran
 ##/
 
 ## Check if there is a cansnper path to expand
+cansnps_datasets = {} # canSNP -> leaf metadata accessions with canSNP
+branch_cansnps_datasets = {} # canSNP -> branch metadata accessions with canSNP
 if cansnper_column != None:
     if cansnper_column in db_columns:
         print(f'Expanding CanSNPs in leaf metadata')
-        accession_metadata,db_columns = metadata_parse_canSNPer_column(accession_metadata,db_columns,cansnps_to_use)
+        accession_metadata,db_columns,cansnps_datasets = metadata_parse_canSNPer_column(accession_metadata,db_columns,cansnps_to_use)
     if cansnper_column in db_columns_branches:
         print(f'Expanding CanSNPs in branch metadata')
-        branch_accession_metadata,db_columns_branches = metadata_parse_canSNPer_column(branch_accession_metadata,db_columns_branches,cansnps_to_use)
+        branch_accession_metadata,db_columns_branches,branch_cansnps_datasets = metadata_parse_canSNPer_column(branch_accession_metadata,db_columns_branches,cansnps_to_use)
 ##/
 ###/
 
-### Assign node datasets
-## Assign node datasets and keep track of parental nodes
-datasets_nodes = {} # dataset -> nodes
-branchNodes_parentNodes = {} # node -> parentNode
-leafNodes_parentNodes = {} # leafNode -> parentNode
-for dataset in datasets:
-    dataset_ancestor_path = tree.get_path(dataset)
-    for node_enum,_ in enumerate(dataset_ancestor_path):
-        # get node
-        node_name = dataset_ancestor_path[node_enum].name
-        #/
-        # get node parent (if possible)
-        node_parent_name = None
-        if node_enum > 0:
-            node_parent_name = dataset_ancestor_path[node_enum-1].name
-        #/
-        # check if current node is a leaf (dataset). If so, then save its parent
-        if node_name == dataset:
-            leafNodes_parentNodes[node_name] = node_parent_name
-        #/
-        # save node datasets
-        if not node_name in datasets_nodes:             datasets_nodes[node_name] = set()
-        datasets_nodes[node_name].add(dataset)
-        #/
-        # save node parent
-        if node_parent_name != None:
-            branchNodes_parentNodes[node_name] = node_parent_name
-        #/
-##/
-
-## Restructure: branchNode -> childNode
-branchNodes_childNodes = {} # node -> childNode
-for branchNode,parentNode in branchNodes_parentNodes.items():
-    if not parentNode in branchNodes_childNodes:            branchNodes_childNodes[parentNode] = set()
-    branchNodes_childNodes[parentNode].add(branchNode)
+### Index nodes
+## Clade datasets are the leaf_order interval [leaf_lo,leaf_hi) of a node, parents are read from the tree arrays
+names_nodes = ftree.node_index() # node name -> node
+ftree_parents = ftree.parent.tolist()
+leaf_order = leaf_order.tolist()
+leaf_lo = leaf_lo.tolist()
+leaf_hi = leaf_hi.tolist()
 ##/
 ###/
 
@@ -356,7 +572,7 @@ for dataset,metadata in accession_metadata.items():
         if not column in metadata_cols_vals_datasets:               metadata_cols_vals_datasets[column] = {}
         if not value in metadata_cols_vals_datasets[column]:       metadata_cols_vals_datasets[column][value] = set()
         metadata_cols_vals_datasets[column][value].add(dataset)
-print(f'There are N={len(metadata_cols_vals_datasets)} imported leaf metadata columns')
+print(f'There are N={len(metadata_cols_vals_datasets)+len(cansnps_datasets)} imported leaf metadata columns')
 ###/
 
 ### Use metadata to determine branch-node stuff
@@ -367,40 +583,191 @@ for dataset,metadata in branch_accession_metadata.items():
         if not column in branch_metadata_cols_vals_datasets:               branch_metadata_cols_vals_datasets[column] = {}
         if not value in branch_metadata_cols_vals_datasets[column]:       branch_metadata_cols_vals_datasets[column][value] = set()
         branch_metadata_cols_vals_datasets[column][value].add(dataset)
-print(f'There are N={len(branch_metadata_cols_vals_datasets)} imported branch metadata columns')
+print(f'There are N={len(branch_metadata_cols_vals_datasets)+len(branch_cansnps_datasets)} imported branch metadata columns')
 ##/
 
 ## Compute metadata at branchnodes
+# index named branch nodes by their leaf interval, so that a set of datasets resolves to its clade with one lookup. Root is excluded (it is not part of root->leaf paths)
+leafIntervals_branchnodes = {} # (leaf_lo,leaf_hi) -> branch nodes (more than one if unary branch nodes are stacked)
+for node in range(1,len(ftree)):
+    if ftree.is_leaf(node) or not ftree.name(node): continue
+    leaf_interval = (leaf_lo[node],leaf_hi[node])
+    if not leaf_interval in leafIntervals_branchnodes:         leafIntervals_branchnodes[leaf_interval] = []
+    leafIntervals_branchnodes[leaf_interval].append(ftree.name(node))
+#/
+if not 0 < branch_match_threshold <= 1:
+    print(f'FATAL: --branch_match_threshold must be above 0 and at most 1, got {branch_match_threshold}')
+    sys.exit()
+lca_index = None # LCA index for MRCA and clade scoring, only needed for inexact matching or the concordance report
+nodes_branchClades = None # node -> the node or its nearest ancestor with a branch node (-1 if none), to score clades that can be annotated
+if branch_match_threshold < 1 or concordance_report_path != None:
+    lca_index = tree_core.LCAIndex(ftree)
+    nodes_branchClades = []
+    for node in range(len(ftree)): # preorder, so the parent is set before its children
+        if node == 0:
+            nodes_branchClades.append(-1) # root is not a branch node
+        elif (leaf_lo[node],leaf_hi[node]) in leafIntervals_branchnodes:
+            nodes_branchClades.append(node)
+        else:
+            nodes_branchClades.append(nodes_branchClades[ftree_parents[node]])
+concordance_rows = [] # [row,sorted leaf positions of the value datasets] for concordance report. Clades are scored after the final labelling
 column_vals_branchnodes = {} # column -> values -> "branchnode where all branchnode_datasets have a metadata value"
+# get branch metadata columns and values to match. CanSNP columns have the value True (accessions with the canSNP) and False (other accessions), in the order of the first accession as before
+columns_values = [] # [column,value]
 for column in branch_metadata_cols_vals_datasets:
+    for value in branch_metadata_cols_vals_datasets[column]:
+        columns_values.append([column,value])
+if branch_cansnps_datasets:
+    first_accession = next(iter(branch_accession_metadata))
+    for column in db_columns_branches:
+        if not column in branch_cansnps_datasets: continue
+        cansnp_values = [True,False]
+        if not first_accession in branch_cansnps_datasets[column]:     cansnp_values = [False,True]
+        for value in cansnp_values:
+            if value == False and len(branch_cansnps_datasets[column]) == len(branch_accession_metadata): continue # all accessions have the canSNP
+            columns_values.append([column,value])
+branch_accessions_leaf_positions = sorted([leaf_lo[names_nodes[dataset]] for dataset in branch_accession_metadata if dataset in datasets])
+#/
+for column,value in columns_values:
     # check if user supplied specific columns to use for branches only
     if db_columns_branches_raw != None:
         if not column in db_columns_branches: continue
     #/
-    for value in branch_metadata_cols_vals_datasets[column]:
+    # get the leaf order interval of the datasets (fingerprint of the clade). It is a clade if the datasets fill it completely
+    match_clades = True # select the best-scoring clade. CanSNP "False" values (the other accessions) only match their exact clade
+    if column in branch_cansnps_datasets:
+        cansnp_leaf_positions = [leaf_lo[names_nodes[dataset]] for dataset in branch_cansnps_datasets[column]]
+        if value == True:
+            datasets_with_col_val = branch_cansnps_datasets[column]
+            matched_interval = get_leaf_interval(cansnp_leaf_positions)
+        else:
+            datasets_with_col_val = None # "False" datasets are the other accessions. Only made if clades are scored
+            matched_interval = get_leaf_interval_complement(branch_accessions_leaf_positions,set(cansnp_leaf_positions))
+            match_clades = False
+    else:
         datasets_with_col_val = branch_metadata_cols_vals_datasets[column][value]
+        if not datasets_with_col_val.issubset(datasets): continue
+        matched_interval = get_leaf_interval([leaf_lo[names_nodes[dataset]] for dataset in datasets_with_col_val])
+    #/
+    # score clades and select the best one above threshold (highest purity*completeness, the larger clade on ties). At threshold 1 this is the exact clade
+    if lca_index != None:
+        if datasets_with_col_val == None:       datasets_with_col_val = set(branch_accession_metadata).difference(branch_cansnps_datasets[column])
+        mrca,candidates,value_leaf_positions = score_value_clades(datasets_with_col_val)
+        if match_clades:
+            best_clade = None
+            for purity,completeness,node in candidates:
+                if min(purity,completeness) < branch_match_threshold: continue
+                clade_score = [purity*completeness,leaf_hi[node]-leaf_lo[node],purity,completeness,node]
+                if best_clade == None or clade_score[:2] > best_clade[:2]:
+                    best_clade = clade_score
+            matched_interval = None
+            if best_clade != None:
+                matched_interval = (leaf_lo[best_clade[-1]],leaf_hi[best_clade[-1]])
         
-        for branchnode,branchnode_datasets in datasets_nodes.items():
-            if not branchnode in branchnodes_names: continue # skip if not a branch node
-            if branchnode_datasets == datasets_with_col_val: # check if sets of datasets are identical between metadata and tree branch
-                if not column in column_vals_branchnodes:               column_vals_branchnodes[column] = {}
-                if not value in column_vals_branchnodes[column]:        column_vals_branchnodes[column][value] = set()
-                column_vals_branchnodes[column][value].add(branchnode)
+        mrca_num_datasets = leaf_hi[mrca]-leaf_lo[mrca]
+        tmp_row = [column,value,len(datasets_with_col_val),ftree.name(mrca) or 'root',mrca_num_datasets,round(len(datasets_with_col_val)/mrca_num_datasets,4)]
+        concordance_rows.append([tmp_row,value_leaf_positions])
+    #/
+    if matched_interval == None: continue
+    for branchnode in leafIntervals_branchnodes.get(matched_interval,[]): # branch nodes with the (best matching) set of datasets
+        if not column in column_vals_branchnodes:               column_vals_branchnodes[column] = {}
+        if not value in column_vals_branchnodes[column]:        column_vals_branchnodes[column][value] = set()
+        column_vals_branchnodes[column][value].add(branchnode)
+##/
+## Compute per-clade counts of branch metadata values in one post-order pass (if specified). Use them to label branch-nodes by consensus
+if branch_consensus != None and not 0.5 < branch_consensus <= 1:
+    print(f'FATAL: --branch_consensus must be above 0.5 and at most 1, got {branch_consensus}')
+    sys.exit()
+if branch_consensus != None or clade_counts_path != None:
+    # get branch metadata values at leaf nodes
+    leafNodes_values = {} # leaf node -> column -> value
+    for dataset,metadata in branch_accession_metadata.items():
+        if not dataset in datasets: continue
+        leafNodes_values[names_nodes[dataset]] = {}
+        for column,value in metadata.items():
+            if db_columns_branches_raw != None and not column in db_columns_branches: continue
+            leafNodes_values[names_nodes[dataset]][column] = value
+    for cansnp,cansnp_datasets in branch_cansnps_datasets.items(): # only canSNPs present at leaves ("True") are counted
+        for dataset in cansnp_datasets:
+            leafNodes_values[names_nodes[dataset]][cansnp] = True
+    #/
+    # aggregate counts bottom-up and save the consensus value of each column at each branch node
+    branchNodes_consensus = {} # branch node -> column -> consensus value
+    clade_counts_file = None
+    if clade_counts_path != None:
+        clade_counts_file = open(clade_counts_path,'w')
+        clade_counts_file.write('\t'.join(['node','num_datasets','column','value','count'])+'\n')
+    for node,counts,majorities in tree_core.clade_value_counts(ftree,leafNodes_values):
+        if ftree.is_leaf(node): continue
+        num_node_datasets = leaf_hi[node]-leaf_lo[node]
+        if clade_counts_file != None:
+            node_name = ftree.name(node) or 'root'
+            for (column,value),count in counts.items():
+                clade_counts_file.write('\t'.join(map(str,[node_name,num_node_datasets,column,value,count]))+'\n')
+        if branch_consensus != None:
+            for column,(count,value) in majorities.items():
+                if count / num_node_datasets >= branch_consensus:
+                    if not node in branchNodes_consensus:       branchNodes_consensus[node] = {}
+                    branchNodes_consensus[node][column] = value
+    if clade_counts_file != None:
+        clade_counts_file.close()
+    #/
+    # label the highest branch node of each consensus clade (no ancestor has the same label). Replaces the matched clades
+    if branch_consensus != None:
+        column_vals_branchnodes = {}
+        nodes_labelsAbove = {0:{}} # node -> column -> value labelled at the node or an ancestor. Shared with the parent when the node adds no label
+        for node in ftree.preorder():
+            if node == 0: continue
+            labels_above = nodes_labelsAbove[ftree_parents[node]]
+            if node in branchNodes_consensus and ftree.name(node):
+                for column,value in branchNodes_consensus[node].items():
+                    if value is False or value == '': continue # absent CanSNPs and empty values do not make labels
+                    if labels_above.get(column) == value: continue
+                    if not column in column_vals_branchnodes:               column_vals_branchnodes[column] = {}
+                    if not value in column_vals_branchnodes[column]:        column_vals_branchnodes[column][value] = set()
+                    column_vals_branchnodes[column][value].add(ftree.name(node))
+                    labels_above = dict(labels_above)
+                    labels_above[column] = value
+            nodes_labelsAbove[node] = labels_above
+    #/
 ##/
 ###/
 
 ##### OUTPUTS
-### Check if output FlexTaxD-formatted files (nodes renamed based on metadata)
-if flextaxd_outfiles_path != None:
+### Check if output concordance report (how well each branch metadata value matches a clade)
+if concordance_report_path != None:
+    print('Output concordance report now')
+    # score the clades of the final branch labels (--branch_consensus replaces the labels of clade matching)
+    concordance_rows = [row+score_labelled_clades(row[0],row[1],value_leaf_positions) for row,value_leaf_positions in concordance_rows]
+    #/
+    with open(concordance_report_path,'w') as nf:
+        nf.write('\t'.join(['column','value','num_datasets','mrca','mrca_num_datasets','mrca_purity','annotated_branch_nodes','clade_num_datasets','clade_purity','clade_completeness'])+'\n')
+        for row in concordance_rows:
+            nf.write('\t'.join(map(str,row))+'\n')
+    # print summary per column
+    columns_summary = {} # column -> [number of values,number of values annotated at a branch node,number of values with an exact clade]
+    for row in concordance_rows:
+        if not row[0] in columns_summary:       columns_summary[row[0]] = [0,0,0]
+        columns_summary[row[0]][0] += 1
+        if row[6]:                              columns_summary[row[0]][1] += 1
+        if row[5] == 1:                         columns_summary[row[0]][2] += 1
+    for column,(num_values,num_annotated,num_exact) in columns_summary.items():
+        print(f'Concordance of column {column}: N={num_values} values, N={num_annotated} annotated at branch nodes, N={num_exact} with an exact clade')
+    #/
+###/
+### Check if output FlexTaxD-formatted files, database and/or taxdump (nodes renamed based on metadata)
+if flextaxd_outfiles_path != None or flextaxd_database != None or taxdump_outfiles_path != None:
     print('Begin constructing FlexTaxD output')
-    # Make (deep)copy of tree and modify node names for FTD-output
-    import copy
-    ftd_tree = copy.deepcopy(tree)
+    # Keep node names for FTD-output in an overlay, the tree itself is not modified
+    nodes_ftd_names = {} # node -> new name
+    ftd_branch_nodes = [node for node in ftree.preorder() if not ftree.is_leaf(node)] # in pre-order
     #/
     #@ BRANCH NODES: Rename branch nodes
     print('Begin determine branch node names')
     # Determine new names for branch nodes based on metadata (in order, to get naming controllable. e.g.: species->subspecies->canSNP)
     branch_nodes_rename = {} # old name -> new name
+    branchNodes_annotations = {} # branchnode original name -> [[annotation number,value]], to apply downstream
+    num_annotations = 0
     branch_nodes_ranks = {} # branchnode original name -> "rank"
     for db_column in db_columns_branches:
         if db_column in column_vals_branchnodes:
@@ -438,28 +805,37 @@ if flextaxd_outfiles_path != None:
                     
                     branch_nodes_rename[branch_node].append(val_to_save)
                     #/
-                    # check if user wants to apply rename to all downstream branch nodes
+                    # check if user wants to apply rename to all downstream branch nodes (numbered, to keep the order of values when inherited below)
                     if flextaxd_apply_downstream:
-                        # get the tree node
-                        branch_node_treeObject = ftd_tree.find_any(branch_node)
-                        #/
-                        # get all downstreams (branch-nodes only)
-                        downstream_nodes = branch_node_treeObject.get_nonterminals()
-                        if downstream_nodes[0].name == branch_node:         downstream_nodes = downstream_nodes[1:] # remove current branchnode from "downstreams" (self is returned by biopython function and is first in list)
-                        #/
-                        print(f'Applying to downstream nodes: {val_to_save}')
-                        # rename each downstream
-                        for downstream_node in downstream_nodes:
-                            downstream_node_name = downstream_node.name
-                            if not downstream_node_name in branch_nodes_rename:      branch_nodes_rename[downstream_node_name] = []
-                            branch_nodes_rename[downstream_node_name].append(val_to_save)
-                        #/
+                        if not branch_node in branchNodes_annotations:         branchNodes_annotations[branch_node] = []
+                        branchNodes_annotations[branch_node].append([num_annotations,val_to_save])
+                        num_annotations += 1
                     #/
     
+    # apply annotations to all downstream branch nodes in one top-down traversal. A node inherits the annotations of its
+    # parent merged with its own, in annotation order. Nodes without own annotations share the lists of their parent
+    if flextaxd_apply_downstream:
+        print('Applying branch metadata to downstream nodes')
+        nodes_inherited = {0:[[],[]]} # node -> [annotations,values] of the node and its ancestors
+        num_downstream_applied = 0
+        for node in ftree.preorder():
+            if node == 0 or ftree.is_leaf(node): continue
+            node_name = ftree.name(node)
+            inherited = nodes_inherited[ftree_parents[node]]
+            if node_name in branchNodes_annotations:
+                node_annotations = sorted(inherited[0]+branchNodes_annotations[node_name])
+                inherited = [node_annotations,[value for _,value in node_annotations]]
+            nodes_inherited[node] = inherited
+            if len(inherited[1]) > len(branchNodes_annotations.get(node_name,[])):
+                branch_nodes_rename[node_name] = inherited[1]
+                num_downstream_applied += 1
+        print(f'Applied branch metadata downstream, N={num_annotations} annotations to N={num_downstream_applied} branch nodes with annotated ancestors')
+    #/
+    
     branch_names_used = {} # keep track of which names were used to never put a duplicate name in case metadata is identical across nodes. Link to original tree node name
     branch_node_basename_sep = '_' # separator to use between branch basename and enumerate
-    for branch_node in ftd_tree.get_nonterminals():
-        branch_node_name = branch_node.name
+    for branch_node in ftd_branch_nodes:
+        branch_node_name = ftree.name(branch_node)
         if branch_node_name in branch_nodes_rename:
             # determine new name at branch
             rename_to = branch_node_basename+branch_node_basename_sep+'_'.join(map(str,branch_nodes_rename[branch_node_name]))
@@ -486,16 +862,19 @@ if flextaxd_outfiles_path != None:
     #/
     # Do branch-node renaming
     print('Renaming branches now')
-    for branch_node in ftd_tree.get_nonterminals():
-        branch_node_name = branch_node.name
-        for rename_to,rename_from in branch_names_used.items():
-            if rename_from == branch_node_name:
-                # INFOprint
-                print(f'Renamed branch {branch_node_name} -> {rename_to}')
-                #/
-                # set new name at node
-                branch_node.name = rename_to
-                #/
+    branchNodes_renamed = {} # original name -> new name (reverse of branch_names_used)
+    for rename_to,rename_from in branch_names_used.items():
+        branchNodes_renamed[rename_from] = rename_to
+    for branch_node in ftd_branch_nodes:
+        branch_node_name = ftree.name(branch_node)
+        if branch_node_name in branchNodes_renamed:
+            rename_to = branchNodes_renamed[branch_node_name]
+            # INFOprint
+            print(f'Renamed branch {branch_node_name} -> {rename_to}')
+            #/
+            # set new name at node
+            nodes_ftd_names[branch_node] = rename_to
+            #/
     #/
     #@/BRANCH NODES
     
@@ -504,14 +883,17 @@ if flextaxd_outfiles_path != None:
     # Determine new names for leaf nodes
     leaf_names_used = {} # keep track of which names were used to never put a duplicate name in case metadata is identical across multiple nodes.
     leaf_node_basename_sep = '_'
-    for leaf_node in ftd_tree.get_terminals():
-        leaf_node_name = leaf_node.name
+    for leaf_node in leaf_order:
+        leaf_node_name = ftree.name(leaf_node)
         if leaf_node_name in accession_metadata:
             metadata = accession_metadata[leaf_node_name]
             
             # get metadata to use in new name
             leaf_new_name = []
             for db_column in db_columns:
+                if db_column in cansnps_datasets:
+                    if leaf_node_name in cansnps_datasets[db_column]:       leaf_new_name.append(db_column) # canSNP present: save the column name
+                    continue
                 if db_column in metadata:
                     column_val = metadata[db_column]
                     # skip value if empty
@@ -550,129 +932,162 @@ if flextaxd_outfiles_path != None:
     #/
     # Do leaf-node renaming
     print('Renaming leafs now')
-    for leaf_node in ftd_tree.get_terminals():
-        leaf_node_name = leaf_node.name
-        for rename_to,rename_from in leaf_names_used.items():
-            if rename_from == leaf_node_name:
-                # INFOprint
-                print(f'Renamed leaf {leaf_node_name} -> {rename_to}')
-                #/
-                # set new name at node
-                leaf_node.name = rename_to
-                #/
+    leafNodes_renamed = {} # original name -> new name (reverse of leaf_names_used)
+    for rename_to,rename_from in leaf_names_used.items():
+        leafNodes_renamed[rename_from] = rename_to
+    for leaf_node in leaf_order:
+        leaf_node_name = ftree.name(leaf_node)
+        if leaf_node_name in leafNodes_renamed:
+            rename_to = leafNodes_renamed[leaf_node_name]
+            # INFOprint
+            print(f'Renamed leaf {leaf_node_name} -> {rename_to}')
+            #/
+            # set new name at node
+            nodes_ftd_names[leaf_node] = rename_to
+            #/
     #/
     #@/LEAF NODES
     ##/
-    ## Check if user wants to load additional genomes (i.e. genomes_map with genomes that were redundant in RepGenR)
-    additional_genomes = {} # genome_name -> accession
+    ## Check if user wants to load additional genomes (i.e. genomes_map with genomes that were redundant in RepGenR). The file is streamed when writing the genome map below
     if flextaxd_additional_genomes != None:
         print(f'Additional genomes supplied: {flextaxd_additional_genomes}')
-        additional_genomes_including_dereplicated = 0
-        with open(flextaxd_additional_genomes,'r') as f:
-            for line in f:
-                # parse line
-                line = line.strip('\n')
-                line = line.split('\t')
-                #/
-                # parse data
-                genome_accn,genome_name = line
-                #/
-                # save data
-                if not genome_name in additional_genomes:           additional_genomes[genome_name] = set()
-                additional_genomes[genome_name].add(genome_accn)
-                
-                additional_genomes_including_dereplicated += 1
-                #/
-        print(f'Number of leafs imported N={len(additional_genomes)}, total number of genomes including dereplicated N={additional_genomes_including_dereplicated}')
-    #/
-    # rename imported leaf
-    additional_genomes_renamed = {}
-    for genome_name,accns in additional_genomes.items():
-        # get new name, determined above
-        genome_name_new = None
-        for rename_to,rename_from in leaf_names_used.items():
-            if rename_from == genome_name:
-                genome_name_new = rename_to
-        #/
-        # save at new name
-        additional_genomes_renamed[genome_name_new] = accns
-        #/
-    #/
+        if not os.path.exists(flextaxd_additional_genomes):
+            print(f'FATAL: Could not find additional genomes file {flextaxd_additional_genomes}')
+            sys.exit()
     ##/
     ## Make FTD-output
     # init outdir (warn user if directory already exists)
-    if os.path.exists(flextaxd_outfiles_path):
-        raw_input = input(f'WARNING: Directory {flextaxd_outfiles_path} already exists. Do you want to write files here? (y/n): ')
-        if not(raw_input and raw_input.lower() in ('yes','y',)):
-            print(f'Answer given: {raw_input}, will terminate now!')
-            sys.exit()
-    if not os.path.exists(flextaxd_outfiles_path):        os.makedirs(flextaxd_outfiles_path)
+    if flextaxd_outfiles_path != None:
+        if os.path.exists(flextaxd_outfiles_path):
+            raw_input = input(f'WARNING: Directory {flextaxd_outfiles_path} already exists. Do you want to write files here? (y/n): ')
+            if not(raw_input and raw_input.lower() in ('yes','y',)):
+                print(f'Answer given: {raw_input}, will terminate now!')
+                sys.exit()
+        if not os.path.exists(flextaxd_outfiles_path):        os.makedirs(flextaxd_outfiles_path)
+    if taxdump_outfiles_path != None:
+        if os.path.exists(taxdump_outfiles_path):
+            raw_input = input(f'WARNING: Directory {taxdump_outfiles_path} already exists. Do you want to write files here? (y/n): ')
+            if not(raw_input and raw_input.lower() in ('yes','y',)):
+                print(f'Answer given: {raw_input}, will terminate now!')
+                sys.exit()
+        if not os.path.exists(taxdump_outfiles_path):        os.makedirs(taxdump_outfiles_path)
+    #/
+    # init database (warn user if it already exists). Rows are added to it as the files below are written
+    ftd_db = None
+    if flextaxd_database != None:
+        if os.path.exists(flextaxd_database):
+            raw_input = input(f'WARNING: Database {flextaxd_database} already exists. Do you want to overwrite it? (y/n): ')
+            if not(raw_input and raw_input.lower() in ('yes','y',)):
+                print(f'Answer given: {raw_input}, will terminate now!')
+                sys.exit()
+        if os.path.dirname(flextaxd_database) and not os.path.exists(os.path.dirname(flextaxd_database)):      os.makedirs(os.path.dirname(flextaxd_database))
+        ftd_db = flextaxd_db.FlexTaxDDatabaseWriter(flextaxd_database)
+        if flextaxd_root_name_linker != None:       ftd_db.add_relation(None,flextaxd_root_name_linker) # linker is the top node of the imported tree
     #/
     # Write tree structure (as parent-child, flextaxd format. AKA "tree2tax" argument "--mod_file")
-    parent_childs_written = []
+    # Relations are written in one pre-order traversal, each edge when its child is visited. This is the order of root->leaf paths taken leaf by leaf
+    parent_childs_written = set()
     print('Output tree relations now')
-    with open(flextaxd_outfiles_path+'/'+'tree_parent_child_relations.tsv','w') as nf:
+    nf = None
+    if flextaxd_outfiles_path != None:
+        nf = open(flextaxd_outfiles_path+'/'+'tree_parent_child_relations.tsv','w',buffering=1048576)
+    if nf != None or ftd_db != None:
         # write header
         tmp_header = ['parent','child']
         
         if flextaxd_rank_columns != None:           tmp_header.append('rank') # if user wants to use metadata to determine rank, then add this column
         
-        nf.write('\t'.join(tmp_header)+'\n')
+        if nf != None:      nf.write('\t'.join(tmp_header)+'\n')
         #/
-        # write rows
-        for leaf in ftd_tree.get_terminals():
-            # get path with node names
-            path = [] # root -> branchnode_N -> ... -> leaf
-            if flextaxd_root_name_linker != None:      path.append(flextaxd_root_name_linker) # if user specified a root name to use
-            for node in ftd_tree.get_path(leaf):
-                path.append(node.name)
-            #/
-            # save parent-child relations
-            for path_enum,parent in enumerate(path):
-                if len(path)-1 == path_enum: continue # skip if we cannot get a child for current parent, i.e. out of boundary, we are finished
-                child = path[path_enum+1]
-                tmp_write = [parent,child]
+        # write rows (the root is not part of root->leaf paths. If user specified a root name to use, it is the parent of the root's children)
+        for node in ftree.preorder():
+            if node == 0: continue
+            child = nodes_ftd_names.get(node) or ftree.name(node)
+            if ftree_parents[node] == 0:
+                parent = flextaxd_root_name_linker
+                if parent == None:
+                    if ftd_db != None:      ftd_db.add_relation(None,child) # link to the database root
+                    continue
+            else:
+                parent = nodes_ftd_names.get(ftree_parents[node]) or ftree.name(ftree_parents[node])
+            tmp_write = [parent,child]
+            
+            # check if user wanted to add a rank from metadata (applies to "child")
+            if flextaxd_rank_columns != None:
+                rank_to_write = ''
                 
-                # check if user wanted to add a rank from metadata (applies to "child")
-                if flextaxd_rank_columns != None:
-                    rank_to_write = ''
-                    
-                    # check if this node should have a rank
-                    if child in branch_nodes_ranks:
-                        rank_to_write = branch_nodes_ranks[child] # check for non-renamed branch nodes
-                    if child in branch_names_used:
-                        old_parent_name = branch_names_used[child] # check for renamed branch nodes, get the original branch name
-                        if old_parent_name in branch_nodes_ranks:
-                            rank_to_write = branch_nodes_ranks[ old_parent_name ]
-                    #/
-                    # add rank to writeArr
-                    if len(rank_to_write) > 1:
-                        print(f'WARNING: Multiple ranks found for relation: {parent} {child}. This indicates that your metadata ambiguously describe your input (not expected for taxonomic ranks)')
-                    
-                    rank_to_write = ','.join(rank_to_write)
-                    tmp_write.append(rank_to_write)
-                    #/
+                # check if this node should have a rank
+                if child in branch_nodes_ranks:
+                    rank_to_write = branch_nodes_ranks[child] # check for non-renamed branch nodes
+                if child in branch_names_used:
+                    old_parent_name = branch_names_used[child] # check for renamed branch nodes, get the original branch name
+                    if old_parent_name in branch_nodes_ranks:
+                        rank_to_write = branch_nodes_ranks[ old_parent_name ]
                 #/
+                # add rank to writeArr
+                if len(rank_to_write) > 1:
+                    print(f'WARNING: Multiple ranks found for relation: {parent} {child}. This indicates that your metadata ambiguously describe your input (not expected for taxonomic ranks)')
                 
-                # only write this relationship if it was not already written in a previous path
-                if not tmp_write in parent_childs_written:
-                    # write row
-                    nf.write('\t'.join(map(str,tmp_write))+'\n')
-                    #/
-                    # keep track of written relationships
-                    parent_childs_written.append(tmp_write)
-                    #/
+                rank_to_write = ','.join(rank_to_write)
+                tmp_write.append(rank_to_write)
                 #/
             #/
+            
+            # only write this relationship if it was not already written (e.g. nodes with identical names)
+            tmp_write = tuple(map(str,tmp_write))
+            if not tmp_write in parent_childs_written:
+                if nf != None:          nf.write('\t'.join(tmp_write)+'\n')
+                if ftd_db != None:      ftd_db.add_relation(*tmp_write)
+                parent_childs_written.add(tmp_write)
+            #/
         #/
+    if nf != None:      nf.close()
     #/
-    # Write nodes/genomes (AKA "genomeid2taxid" argument "--genomeid2taxid")
+    # Write NCBI taxdump (nodes.dmp, names.dmp) in one pre-order traversal. Each node gets its own taxid, given in traversal
+    # order so that the parent taxid is always known. The root is taxid 1 and its own parent. Genomes are mapped to the taxid
+    # of their leaf in seqid2taxid.map, written together with the genome map below
+    leafs_taxids = {} # leaf original name -> taxid, to map genomes
+    af = None
+    if taxdump_outfiles_path != None:
+        print('Output taxdump now')
+        nodes_taxids = {} # node -> taxid
+        with open(taxdump_outfiles_path+'/'+'nodes.dmp','w',buffering=1048576) as nodes_out, open(taxdump_outfiles_path+'/'+'names.dmp','w',buffering=1048576) as names_out:
+            for node in ftree.preorder():
+                # get taxid, parent taxid and name
+                taxid = len(nodes_taxids)+1
+                nodes_taxids[node] = taxid
+                if node == 0:
+                    parent_taxid = taxid
+                    node_name = flextaxd_root_name_linker or 'root'
+                else:
+                    parent_taxid = nodes_taxids[ftree_parents[node]]
+                    node_name = nodes_ftd_names.get(node) or ftree.name(node)
+                node_name = str(node_name).replace('|','_') # "|" is the field separator
+                #/
+                # get rank (from the original branch name, as in tree relations). A taxdump node has a single rank, use the first one
+                rank = 'no rank'
+                if ftree.name(node) in branch_nodes_ranks:
+                    rank = branch_nodes_ranks[ftree.name(node)][0]
+                #/
+                nodes_out.write('\t|\t'.join([str(taxid),str(parent_taxid),rank]+['']*10)+'\t|\n')
+                names_out.write('\t|\t'.join([str(taxid),node_name,'','scientific name'])+'\t|\n')
+                # save taxid of renamed leafs
+                if ftree.is_leaf(node) and ftree.name(node) in leafNodes_renamed:
+                    leafs_taxids[ftree.name(node)] = taxid
+                #/
+        af = open(taxdump_outfiles_path+'/'+'seqid2taxid.map','w',buffering=1048576)
+    #/
+    # Write nodes/genomes (AKA "genomeid2taxid" argument "--genomeid2taxid"). Also the taxdump seqid2taxid.map, in the same pass
     print('Output genomes info now')
-    with open(flextaxd_outfiles_path+'/'+'genome_id_map.tsv','w') as nf:
+    nf = None
+    if flextaxd_outfiles_path != None:
+        nf = open(flextaxd_outfiles_path+'/'+'genome_id_map.tsv','w',buffering=1048576)
+    num_accns_taxids = 0 # rows written to seqid2taxid.map
+    if nf != None or ftd_db != None or af != None:
         # headerless file
         #/
         ## Write rows
-        rows_written = [] # keep track of which rows were written. When user imported additional genomes, do not write leaf-nodes from tree twice
+        seen_accns = set() # accessions written. When user imported additional genomes, do not write leaf-nodes from tree (or duplicated rows in file) twice
         # write rows for "tree leafs"
         for node_name,original_name in leaf_names_used.items():
             # parse accession id from original name (expected at <family>_<genus>_<species>_<GCx>_<number>.<v>)
@@ -683,247 +1098,142 @@ if flextaxd_outfiles_path != None:
                 stripped_string = re.sub(f".*({regex_pattern}).*", r"\1", matched_string)
                 accn = stripped_string # should be formatted as GCX_123456789.1
                 
-                writeArr = [accn,node_name]
-                if not writeArr in rows_written:
-                    nf.write('\t'.join(map(str,writeArr))+'\n')
-                    rows_written.append(writeArr)
+                writeArr = (str(accn),str(node_name))
+                if not accn in seen_accns:
+                    if nf != None:          nf.write('\t'.join(writeArr)+'\n')
+                    if ftd_db != None:      ftd_db.add_genome(*writeArr)
+                    if af != None and original_name in leafs_taxids:
+                        af.write(accn+'\t'+str(leafs_taxids[original_name])+'\n')
+                        num_accns_taxids += 1
+                    seen_accns.add(accn)
             #/
         #/
-        # write rows loaded from "additional genomes"
-        for node_name,accns in additional_genomes_renamed.items():
-            for accn in accns:
-                # format: col1=accession_number, col2=node_name
-                writeArr = [accn,node_name]
-                if not writeArr in rows_written:
-                    nf.write('\t'.join(map(str,writeArr))+'\n')
-                    rows_written.append(writeArr)
-                #/
+        # write rows loaded from "additional genomes", streamed line by line and joined against the leaf renames
+        if flextaxd_additional_genomes != None:
+            additional_genomes_names = set() # genome names (leafs) in file
+            additional_genomes_including_dereplicated = 0
+            additional_genomes_missing = 0 # genomes with a leaf that is not renamed in tree
+            with open(flextaxd_additional_genomes,'r') as f:
+                for line in f:
+                    # parse line
+                    line = line.strip('\n')
+                    if not line: continue
+                    line = line.split('\t')
+                    #/
+                    # parse data
+                    genome_accn,genome_name = line
+                    additional_genomes_names.add(genome_name)
+                    additional_genomes_including_dereplicated += 1
+                    #/
+                    # get new name, determined above
+                    node_name = leafNodes_renamed.get(genome_name)
+                    if node_name == None:       additional_genomes_missing += 1
+                    #/
+                    # format: col1=accession_number, col2=node_name
+                    writeArr = (genome_accn,str(node_name))
+                    if not genome_accn in seen_accns:
+                        if nf != None:          nf.write('\t'.join(writeArr)+'\n')
+                        if ftd_db != None:      ftd_db.add_genome(*writeArr)
+                        if af != None and genome_name in leafs_taxids:
+                            af.write(genome_accn+'\t'+str(leafs_taxids[genome_name])+'\n')
+                            num_accns_taxids += 1
+                        seen_accns.add(genome_accn)
+                    #/
+            print(f'Number of leafs imported N={len(additional_genomes_names)}, total number of genomes including dereplicated N={additional_genomes_including_dereplicated}')
+            if additional_genomes_missing:
+                print(f'WARNING: N={additional_genomes_missing} additional genomes belong to leafs that were not renamed in the tree. They were written with node name None')
         #/
         ##/
+    if nf != None:      nf.close()
+    if af != None:
+        af.close()
+        print(f'Taxdump written: {taxdump_outfiles_path} (N={len(nodes_taxids)} taxids, N={num_accns_taxids} accessions)')
+    #/
+    # Finish database (make indexes and move it into place)
+    if ftd_db != None:
+        print('Finalizing FlexTaxD database now')
+        ftd_db.close()
+        print(f'FlexTaxD database written: {flextaxd_database} (N={len(ftd_db.nodes_ids)} nodes, N={ftd_db.num_genomes} genomes)')
+        if ftd_db.num_genomes_skipped:
+            print(f'WARNING: N={ftd_db.num_genomes_skipped} genomes were not written to the database since their node is not in the tree')
     #/
     ##/
 ###/
 
 ### Do plotting
-if plot_output_file_path:
-    # init figure
-    fig,(ax,ax_annotation) = plt.subplots(ncols=2, figsize=(30, 18), gridspec_kw={'width_ratios':[4,1]})
+if plot_output_file_path or plot_svg_output_file_path:
+    ## Get layout and what to draw (shared by all plot pages and the SVG)
+    # node coordinates, computed from the tree (placed as by Biopython's Phylo.draw). One line per node for its branch and
+    # one per branch node joining its children
+    nodes_x,nodes_y = ftree.layout()
+    nodes_parent_x = np.concatenate(([0],nodes_x[ftree.parent[1:]])) # the root branch starts at 0
+    branch_nodes = np.flatnonzero(ftree.first_child != -1)
+    branch_nodes_ytop = nodes_y[ftree.first_child[branch_nodes]]
+    branch_nodes_ybot = 2*nodes_y[branch_nodes]-branch_nodes_ytop # node is midway between its first and last child
+    horizontal_lines = np.stack([np.column_stack([nodes_parent_x,nodes_y]),np.column_stack([nodes_x,nodes_y])],axis=1)
+    vertical_lines = np.stack([np.column_stack([nodes_x[branch_nodes],branch_nodes_ybot]),np.column_stack([nodes_x[branch_nodes],branch_nodes_ytop])],axis=1)
     #/
-    # remove all stuff from ax_annotation
-    if 1:
-        for spine in ax_annotation.spines.values():
-            spine.set_visible(False)
-        ax_annotation.set_xticks([])
-        ax_annotation.set_yticks([])
-        ax_annotation.set_xticklabels([])
-        ax_annotation.set_yticklabels([])
-    #/
-    # remove space between ax and ax_annotation
-    plt.subplots_adjust(wspace=-1)
-    #/
-    # plot tree with biopython-Phylo
-    Phylo.draw(tree, axes=ax,
-               label_func=lambda leaf: leaf.name, # Replace Biopython label function that returns the full name (default, clip >40))
-               do_show=False)
-    #/
-    
-    #@@@@@@@ SECTION: apply metadata visualisations
-    
-    ## determine scale to use for plotting (text and elements)
-    orig_font_size = plt.rcParams['font.size']
-    plot_scaler = 1
-    if 1:
-        if len(datasets) > 200:
-            plot_scaler = 0.3
-        elif len(datasets) > 100:
-            plot_scaler = 0.35
-        elif len(datasets) > 50:
-            plot_scaler = 0.4
-        elif len(datasets) > 40:
-            plot_scaler = 0.6
-        elif len(datasets) > 30:
-            plot_scaler = 0.8
-        elif len(datasets) > 20:
-            plot_scaler = 0.9
-    ##/
-    
-    ## Get position of branch-nodes and leaf-nodes
-    # get position of each dataset text label
+    # get position of each dataset (leaf-node)
     datasets_textlabel_pos = {} # dataset -> pos
     poses_vals_without_outgroup = []
-    datasets_yposes = []
-    for child in ax.get_children():
-        if isinstance(child, plt.Text):
-            label_text = child.get_text().lstrip(' ') # strip bullshit space infront of every text label
-            # skip label if it is a branch-node or reference_sequence or is empty
-            if label_text in branchnodes_names or label_text == '': continue
-            #/
-            # get pos and save
-            position = child.get_position()
-            datasets_textlabel_pos[label_text] = position
-            #/
-            # save coord of x offset (update: and Y-coordinate)
-            if not (outgroup_dataset != None and label_text == outgroup_dataset):
-                poses_vals_without_outgroup.append(position[0])
-                datasets_yposes.append(position[1])
-            #/
+    for leaf_node in leaf_order:
+        dataset = ftree.name(leaf_node)
+        # skip leaf if it is unnamed or has the name of a branch-node
+        if dataset in branchnodes_names or dataset == '': continue
+        #/
+        # save pos
+        position = (float(nodes_x[leaf_node]),float(nodes_y[leaf_node]))
+        datasets_textlabel_pos[dataset] = position
+        #/
+        # save coord of x offset
+        if not (outgroup_dataset != None and dataset == outgroup_dataset):
+            poses_vals_without_outgroup.append(position[0])
+        #/
     #/
-    # get position of branch node text labels
+    # get position of branch nodes
     branchnode_textlabel_pos = {} # branchnode -> pos
-    for child in ax.get_children():
-        if isinstance(child, plt.Text):
-            label_text = child.get_text().lstrip(' ') # strip bullshit space infront of every text label
-            if label_text in branchnodes_names:
-                # get pos and save
-                position = child.get_position()
-                branchnode_textlabel_pos[label_text] = position
-                #/
-    #/
-    # get all x_poses and sort (highest X-value last, for placement of dots)
-    x_vals_sorted = sorted(poses_vals_without_outgroup) #sorted([x for x,y in datasets_textlabel_pos.values()])
+    for branch_node in branch_nodes.tolist():
+        if ftree.name(branch_node):
+            branchnode_textlabel_pos[ftree.name(branch_node)] = (float(nodes_x[branch_node]),float(nodes_y[branch_node]))
     #/
-    # re-position textlabels so that they (1) align and (2) position behind dot and (3) change font size
+    # get dataset positions aligned behind the furthest right dataset (except outgroup)
+    x_val_max = max(poses_vals_without_outgroup)
     datasets_textlabel_pos_repositioned = {}
-    for child in ax.get_children():
-        if isinstance(child, plt.Text):
-            label_text = child.get_text().lstrip(' ') # strip bullshit space infront of every text label
-            if label_text in datasets and (outgroup_dataset == None or label_text != outgroup_dataset):
-                old_pos = child.get_position()
-                child.set_position([x_vals_sorted[-1]+x_vals_sorted[-1]*0.04,old_pos[1]])
-                child.set_fontsize(orig_font_size*(plot_scaler**8))
-                
-                # get pos and save
-                position = child.get_position()
-                datasets_textlabel_pos_repositioned[label_text] = position
-                #/
-    #/
-    # compute average height between datasets (will plot ½ height above and below area-plots to make it look nicer)
-    datasets_avg_plot_distance = (max(datasets_yposes)-min(datasets_yposes))/len(datasets_yposes)
-    #/
-    ##/
-    
-    ## Do plotting in annotation-axes
-    # init-plot invisible line to create axes boundaries
-    ax_annotation.plot([0,0],ax.get_ylim(),alpha=0)
+    for dataset,position in datasets_textlabel_pos.items():
+        if outgroup_dataset == None or dataset != outgroup_dataset:
+            datasets_textlabel_pos_repositioned[dataset] = (x_val_max+x_val_max*0.04,position[1])
     #/
-    # init xoffset and set step size
-    x_offset = 1*(plot_scaler**2)
-    x_offset_init = x_offset
-    x_offset_steps = 2*plot_scaler # increase offset by this step size
+    # get metadata tracks: a color per dataset for each column (ALL METADATA VALUES; NO GROUPING DONE)
+    # add canSNP columns (True: datasets with the canSNP, False: other datasets with metadata)
+    for cansnp,cansnp_datasets in cansnps_datasets.items():
+        metadata_cols_vals_datasets[cansnp] = {True:cansnp_datasets}
+        cansnp_absent_datasets = set(accession_metadata).difference(cansnp_datasets)
+        if cansnp_absent_datasets:      metadata_cols_vals_datasets[cansnp][False] = cansnp_absent_datasets
     #/
-    #@ plot dots for metadata values (BRANCH-MATCHED DATASETS ONLY)
-    if 0:
-        for column in column_vals_branchnodes:
-            for val in column_vals_branchnodes[column]:
-                for branch_node in column_vals_branchnodes[column][val]:
-                    branch_datasets = datasets_nodes[branch_node]
-                    
-                    for dataset in branch_datasets:
-                        dataset_ycoord = datasets_textlabel_pos[dataset][1]
-                        ax_annotation.scatter(x_offset,dataset_ycoord,color='red',s=100*(plot_scaler**2))
-            x_offset += x_offset_steps # for each column, increase x_offset for next column/thing to plot
-    #@/
-    #@ plot dots for metadata values (ALL METADATA VALUES; NO GROUPING DONE)
     valtypes_colors = ['red', 'green', 'blue', 'gold', 'purple', 'crimson','grey']
+    plot_tracks = [] # [[column label,{dataset: color}], ...]
+    plot_max_colum_label_length = 150
     for column in metadata_cols_vals_datasets:
-        # plot dot per value
-        datasets_ycoords = []
+        datasets_colors = {}
         label_description_text = []
         for value_enum,value in enumerate(sorted(metadata_cols_vals_datasets[column])): # sort values so that e.g. values with TRUE/FALSE will have same color across different columns
-            # plot scatters at datasets with this value
+            tmp_color = valtypes_colors[value_enum%len(valtypes_colors)]
             for dataset in metadata_cols_vals_datasets[column][value]:
-                dataset_ycoord = datasets_textlabel_pos[dataset][1]
-                datasets_ycoords.append(dataset_ycoord)
-                
-                tmp_color = valtypes_colors[value_enum%len(valtypes_colors)]
-                ax_annotation.scatter(x_offset,dataset_ycoord,color=tmp_color,s=100*(plot_scaler**2))
-            #/
+                datasets_colors[dataset] = tmp_color
             # append description to label about this value
             label_description_text.append(f'{tmp_color}={value}')
             #/
-        #/
-        # write label
         tmp_label = column+' ('+', '.join(label_description_text)+')'
-        plot_max_colum_label_length = 150
         if len(tmp_label) > plot_max_colum_label_length:
             print(f'Plot label for column {column} is very long. Will clip it now to {plot_max_colum_label_length} characters')
-        ax_annotation.text(x_offset,min(datasets_ycoords)-1,tmp_label[:plot_max_colum_label_length],rotation=45,fontsize=orig_font_size*plot_scaler)
-        #/
-        x_offset += x_offset_steps # for each column, increase x_offset for next column/thing to plot
-    #@/
-    # plot dataset labels
-    for dataset,textlabel_pos in datasets_textlabel_pos.items():
-        ax_annotation.text(x_offset,textlabel_pos[1],dataset,fontsize=orig_font_size*plot_scaler)
-    x_offset += x_offset_steps
+        plot_tracks.append([tmp_label[:plot_max_colum_label_length],datasets_colors])
     #/
-    ##/
-    
-    ## Try to make visual guidelines for datasets<->leafnode connection
-    # for each dataset, get position of text label and parent branch node. Use these coordinates to draw visual guideline
-    for dataset in datasets:
-        # get position of textlabel for dataset (look in "repositioned" first, then in "original". This makes sense for when the outgroup is not repositioned.)
-        textlabel_pos = [0,0]
-        if dataset in datasets_textlabel_pos_repositioned:
-            textlabel_pos = datasets_textlabel_pos_repositioned[dataset]
-        else:
-            textlabel_pos = datasets_textlabel_pos[dataset]
-        #/
-        # get parent branchnode
-        dataset_parent = leafNodes_parentNodes[dataset]
-        #/
-        # get parent branchnode position
-        branchlabel_pos = [0,0] # the dataset with no parent will being in 0,0
-        if dataset_parent != None:
-            branchlabel_pos = branchnode_textlabel_pos[dataset_parent] # update position if dataset had a parent
-        #/
-        # draw guideline
-        ax.plot([branchlabel_pos[0],ax.get_xlim()[1]],[textlabel_pos[1],textlabel_pos[1]],color='grey',linestyle=':',alpha=0.3,zorder=0) # from branchnode to max X value
-        ax_annotation.plot([x_offset_init,x_offset-x_offset_steps],[textlabel_pos[1],textlabel_pos[1]],color='grey',linestyle=':',alpha=0.3,zorder=0) # from xlim start to last used x_offset, at branch_label y value
-        #/
-    #/
-    ##/
-    
-    ## Do area-plotting in left axes
+    # get clade areas of branch metadata
     area_colors = ['gray','green','red','orange','blue']
-    num_area_draws = 0
-    ax_texts_to_keep = []
-    branch_nodes_numTexts = {} # keep track of texts at each branchnode to offset them when multiple texts are plotted
+    plot_areas = [] # [[branch node,color,text], ...]
     for column in column_vals_branchnodes:
         for val in column_vals_branchnodes[column]:
             for branch_node in column_vals_branchnodes[column][val]:
-                branch_datasets = datasets_nodes[branch_node]
-                
-                # get branch node x coord (use plot right border/xlim as xend)
-                area_xstart = branchnode_textlabel_pos[branch_node][0]
-                area_xend = ax.get_xlim()[1]
-                #/
-                # get dataset coords ycoords
-                datasets_ycoords = []
-                for dataset in branch_datasets:
-                    dataset_pos = datasets_textlabel_pos[dataset]
-                    datasets_ycoords.append(dataset_pos[1])
-                area_ystart = min(datasets_ycoords)
-                area_yend = max(datasets_ycoords)
-                #/
-                # plot area
-                tmp_height = area_yend-area_ystart
-                tmp_width = area_xend-area_xstart
-                
-                rect = patches.Rectangle((area_xstart,area_yend), tmp_width, -tmp_height, linewidth=0, facecolor=area_colors[num_area_draws%(len(area_colors)-1)],alpha=0.3) # x,y is bottom left of rectangle. next x2 numbers are width and height
-                ax.add_patch(rect)
-                
-                num_area_draws += 1
-                #/
-                ## add text
-                # get offset/init offset/iterate offset
-                if not branch_node in branch_nodes_numTexts:            branch_nodes_numTexts[branch_node] = 0
-                text_x_offset = branch_nodes_numTexts[branch_node]
-                branch_nodes_numTexts[branch_node] += 1
-                #/
-                # determine coords for text
-                text_x = area_xstart + (area_xend-area_xstart)*(0.1*(1+text_x_offset))
-                text_y = (area_yend+area_ystart)/2
-                #/
                 # determine value to text
                 text_to_plot = None
                 if type(val) == bool and val == True: # if column was a bool, then plot the column name
@@ -931,67 +1241,35 @@ if plot_output_file_path:
                 else:
                     text_to_plot = val # else, plot the value
                 #/
-                # do text-plot
-                txt = ax.text(text_x,text_y,text_to_plot,fontsize=orig_font_size*(plot_scaler*4),color='black')
-                ax_texts_to_keep.append(txt)
-                #/
-                ##/
-    ##/
-    
-    
-    #@@@@@@@/
-    
-    ## cleanup plot
-    # remove branch labels
-    if 1 and 'cleanup branch labels':
-        for text in ax.texts:
-            #if text.get_text().lstrip(' ') in branchnodes_names:
-            if not text in ax_texts_to_keep:
-                text.remove()
-    #/
-    # cleanup display
-    ax.spines['right'].set_visible(False) # remove right plot border
-    ax.spines['top'].set_visible(False) # remove top plot border
-    ax.set_xlabel(None) # remove ylabel
-    ax.set_ylabel(None) # remove ylabel
-    ax.yaxis.set_ticks([]) # remove yticks
-    #/
-    # set plot xand ylimits
-    ax.set_xlim([ax.get_xlim()[0],max([xval for xval,yval in datasets_textlabel_pos.values()])]) # use start of xcoord for furthest right dataset label as end of plot
-    #ax.set_ylim([ax.get_ylim()[0],ax.get_ylim()[1]-10])
-    
-    ax_annotation.set_xlim([0,10+x_offset])
-    ax_annotation.set_ylim(ax.get_ylim())
-    #/
-    # apply layout
-    plt.tight_layout()
-    #/
-    # Show the plot
-    #plt.show()
-    #/
-    
-    # Save as pdf
-    if 1:
-        png_output_path = plot_output_file_path
-        print(f'Dumping plot as PDF: {png_output_path}')
-        plt.savefig(png_output_path)
-    #/
-    
-    # Convert the plot to interactive HTML (check if it is possible to get a richer interface)
-    if 0 and 'needs improvments if it is going to be used':
-        if plot_output_file_path != None and 'works':
-            import mpld3
-            html_str = mpld3.fig_to_html(fig)
-            print(f'Dumping plot as html: {plot_output_file_path}')
-            with open(plot_output_file_path,'w') as nf:
-                nf.write(html_str)
-    #/
-    
-    # output plot as html
-    if 0 and 'does not work with lines plotted. possible to convert to supported format? (LineCollection to ... native line?)':
-        import plotly.tools as tls
-        plotly_fig = tls.mpl_to_plotly(fig)
-        plotly_fig.write_html("interactive_plot_plotly.html")
+                plot_areas.append([names_nodes[branch_node],area_colors[len(plot_areas)%(len(area_colors)-1)],text_to_plot])
     #/
+    ##/
+    ## Draw plot as one figure, or as pages of leaf rows (rendered in parallel by forked worker processes on Linux, that share the data above)
+    if plot_output_file_path:
+        if plot_leafs_per_page == None:
+            draw_plot(plot_output_file_path)
+        else:
+            if plot_leafs_per_page < 1:
+                print('FATAL: --plot_leafs_per_page must be a positive number')
+                sys.exit()
+            plot_output_base,plot_output_ext = os.path.splitext(plot_output_file_path)
+            pages_paths = []
+            pages_rows = []
+            for page_enum,row_first in enumerate(range(1,len(leaf_order)+1,plot_leafs_per_page)):
+                pages_paths.append(f'{plot_output_base}_page{page_enum+1}{plot_output_ext}')
+                pages_rows.append([row_first,min(row_first+plot_leafs_per_page-1,len(leaf_order))])
+            print(f'Plotting N={len(pages_paths)} pages of up to N={plot_leafs_per_page} leafs')
+            if threads > 1 and sys.platform.startswith('linux'): # workers are forked to share the data above. Fork is not safe with the macOS system libraries
+                with ProcessPoolExecutor(max_workers=threads,mp_context=multiprocessing.get_context('fork')) as executor:
+                    list(executor.map(draw_plot,pages_paths,pages_rows))
+            else:
+                for page_path,page_rows in zip(pages_paths,pages_rows):
+                    draw_plot(page_path,page_rows)
+    ##/
+    ## Write SVG
+    if plot_svg_output_file_path:
+        print(f'Dumping plot as SVG: {plot_svg_output_file_path}')
+        tree_core.write_svg(ftree,plot_svg_output_file_path,layout=[nodes_x,nodes_y],leaf_tracks=plot_tracks,areas=plot_areas)
+    ##/
 ###/
 #####/OUTPUTS
\ No newline at end of file
@@ -0,0 +1,701 @@
+import os
+import sys
+import re
+import io
+import hashlib
+from array import array
+from xml.sax.saxutils import escape
+try:            import numpy as np
+except:         sys.exit('Unable to import NumPy package. Please make sure it has been installed.')
+
+class FlexTree:
+    """
+    Array-backed rooted tree, shared by tree.py and tree2.py. Nodes are integer ids and the root is node 0.
+    Per node, the tree keeps:
+        parent, first_child, next_sibling: int32 node ids (-1 if none)
+        dist: float64 branch length to the parent (nan if not set)
+        support: float64 branch support (nan if not set)
+        name_ids: int32 index into names. Each name is stored once, names[0] is '' (unnamed nodes)
+    A compact tree has its nodes numbered in preorder (parent before children, children in order), so that the subtree
+    of node n is the id range [n,subtree_end[n]).
+    Edits with set_children() only relink nodes. Detached nodes keep their old links until compact() is called, which
+    returns a renumbered compact tree without them.
+    """
+
+    def __init__(self,parent,first_child,next_sibling,dist,name_ids,names,support=None):
+        num_nodes = len(parent)
+        self.parent = np.asarray(parent,dtype=np.int32)
+        self.first_child = np.asarray(first_child,dtype=np.int32)
+        self.next_sibling = np.asarray(next_sibling,dtype=np.int32)
+        self.dist = np.asarray(dist,dtype=np.float64)
+        if support is None:
+            support = np.full(num_nodes,np.nan)
+        self.support = np.asarray(support,dtype=np.float64)
+        self.name_ids = np.asarray(name_ids,dtype=np.int32)
+        self.names = names
+        self.names_index = None # name -> name id, built on first call of set_name()
+        self.subtree_end = None # set by compact(), unset by edits
+
+    def __len__(self):
+        return len(self.parent)
+
+    @classmethod
+    def from_parents(cls,parent,dist,names,support=None,preorder=False):
+        """
+        Builds a compact tree from a parent id per node (-1 for the root, which must be node 0), a branch length and a
+        name per node. Children keep the order of their ids. If the ids are already in preorder (e.g. from a parser),
+        set preorder=True to skip renumbering.
+        """
+        num_nodes = len(parent)
+        first_child = [-1]*num_nodes
+        next_sibling = [-1]*num_nodes
+        subtree_sizes = [1]*num_nodes
+        for node in range(num_nodes-1,0,-1):
+            node_parent = parent[node]
+            if node_parent < 0: continue
+            next_sibling[node] = first_child[node_parent]
+            first_child[node_parent] = node
+            subtree_sizes[node_parent] += subtree_sizes[node]
+        # intern names
+        names_index = {'':0}
+        name_ids = [names_index.setdefault(name or '',len(names_index)) for name in names]
+        #/
+        tree = cls(parent,first_child,next_sibling,dist,name_ids,list(names_index),support)
+        if not preorder:
+            return tree.compact()
+        tree.subtree_end = np.arange(num_nodes,dtype=np.int32) + np.asarray(subtree_sizes,dtype=np.int32)
+        return tree
+
+    @classmethod
+    def from_phylo(cls,phylo_tree):
+        """
+        Builds a compact tree from a Biopython Phylo tree (or clade).
+        """
+        parent,dist,names,support = [],[],[],[]
+        stack = [[getattr(phylo_tree,'root',phylo_tree),-1]]
+        while stack:
+            clade,node_parent = stack.pop()
+            node = len(parent)
+            parent.append(node_parent)
+            dist.append(np.nan if clade.branch_length is None else clade.branch_length)
+            names.append(clade.name)
+            support.append(np.nan if clade.confidence is None else clade.confidence)
+            for child_clade in reversed(clade.clades):
+                stack.append([child_clade,node])
+        return cls.from_parents(parent,dist,names,support)
+
+    def to_phylo(self):
+        """
+        Returns the tree as a Biopython Phylo (Newick) tree.
+        """
+        from Bio.Phylo import Newick
+        names = self.names
+        name_ids = self.name_ids.tolist()
+        dist = self.dist.tolist()
+        support = self.support.tolist()
+        parent = self.parent.tolist()
+        clades = {}
+        for node in self.preorder():
+            clade = Newick.Clade(branch_length=dist[node] if dist[node] == dist[node] else None, # nan -> None
+                                 name=names[name_ids[node]] or None,
+                                 confidence=support[node] if support[node] == support[node] else None)
+            if node != 0:
+                clades[parent[node]].clades.append(clade)
+            clades[node] = clade
+        return Newick.Tree(root=clades[0],rooted=False)
+
+    def compact(self):
+        """
+        Returns a new tree numbered in preorder from the root, without nodes that were detached from it.
+        """
+        order = np.fromiter(self.preorder(),dtype=np.int32)
+        old_to_new = np.full(len(self)+1,-1,dtype=np.int32) # last element maps -1 (no node) to -1
+        old_to_new[order] = np.arange(len(order),dtype=np.int32)
+
+        parent = old_to_new[self.parent[order]]
+        parent[0] = -1
+        first_child = old_to_new[self.first_child[order]]
+        next_sibling = old_to_new[self.next_sibling[order]]
+        next_sibling[0] = -1
+        tree = FlexTree(parent,first_child,next_sibling,self.dist[order],self.name_ids[order],list(self.names),self.support[order])
+
+        # set subtree ends: subtree sizes are summed from children to parents
+        subtree_sizes = [1]*len(order)
+        parent_list = parent.tolist()
+        for node in range(len(order)-1,0,-1):
+            subtree_sizes[parent_list[node]] += subtree_sizes[node]
+        tree.subtree_end = np.arange(len(order),dtype=np.int32) + np.asarray(subtree_sizes,dtype=np.int32)
+        #/
+        return tree
+
+    def name(self,node):
+        return self.names[self.name_ids[node]]
+
+    def set_name(self,node,name):
+        if self.names_index is None:
+            self.names_index = {existing_name:name_id for name_id,existing_name in enumerate(self.names)}
+        if not name in self.names_index:
+            self.names_index[name] = len(self.names)
+            self.names.append(name)
+        self.name_ids[node] = self.names_index[name]
+
+    def is_leaf(self,node):
+        return self.first_child[node] == -1
+
+    def get_children(self,node):
+        children = []
+        child = int(self.first_child[node])
+        while child != -1:
+            children.append(child)
+            child = int(self.next_sibling[child])
+        return children
+
+    def set_children(self,node,children):
+        """
+        Links children (in order) as the children of node. Nodes that were children of node before, but are not in
+        children, are detached from the tree (unless they were linked elsewhere).
+        """
+        self.subtree_end = None
+        previous = -1
+        for child in children:
+            self.parent[child] = node
+            if previous == -1:      self.first_child[node] = child
+            else:                   self.next_sibling[previous] = child
+            previous = child
+        if previous == -1:          self.first_child[node] = -1
+        else:                       self.next_sibling[previous] = -1
+
+    def preorder(self,node=0):
+        """
+        Yields the nodes of the subtree of node, parents before children.
+        """
+        if self.subtree_end is not None:
+            yield from range(node,int(self.subtree_end[node]))
+            return
+        parent,first_child,next_sibling = self.parent,self.first_child,self.next_sibling
+        current = node
+        while True:
+            yield int(current)
+            if first_child[current] != -1:
+                current = first_child[current]
+                continue
+            while current != node and next_sibling[current] == -1:
+                current = parent[current]
+            if current == node: return
+            current = next_sibling[current]
+
+    def postorder(self,node=0):
+        """
+        Yields the nodes of the subtree of node, children before parents.
+        """
+        parent,first_child,next_sibling = self.parent,self.first_child,self.next_sibling
+        current = node
+        while first_child[current] != -1:
+            current = first_child[current]
+        while True:
+            yield int(current)
+            if current == node: return
+            if next_sibling[current] != -1:
+                current = next_sibling[current]
+                while first_child[current] != -1:
+                    current = first_child[current]
+            else:
+                current = parent[current]
+
+    def leaves(self,node=0):
+        """
+        Returns the leaf-nodes in the subtree of node, in preorder.
+        """
+        if self.subtree_end is not None:
+            subtree_end = int(self.subtree_end[node])
+            return (np.flatnonzero(self.first_child[node:subtree_end] == -1) + node).tolist()
+        return [child for child in self.preorder(node) if self.first_child[child] == -1]
+
+    def leaf_intervals(self):
+        """
+        Returns [leaf_order,leaf_lo,leaf_hi] (compact trees only). leaf_order holds the leaf-nodes in preorder, so that
+        the leaves of the clade at node n are leaf_order[leaf_lo[n]:leaf_hi[n]]. A leaf-node l is in that clade if
+        leaf_lo[n] <= leaf_lo[l] < leaf_hi[n].
+        """
+        is_leaf = self.first_child == -1
+        leaves_before = np.zeros(len(self)+1,dtype=np.int32) # number of leaves with a lower id than the node
+        np.cumsum(is_leaf,out=leaves_before[1:])
+        leaf_order = np.flatnonzero(is_leaf).astype(np.int32)
+        return [leaf_order,leaves_before[:-1],leaves_before[self.subtree_end]]
+
+    def node_index(self):
+        """
+        Returns a dict of node name -> node for named nodes. If a name is used by more than one node, the first node in
+        preorder is kept.
+        """
+        names = self.names
+        names_nodes = {}
+        name_ids = self.name_ids.tolist()
+        for node in reversed(list(self.preorder())):
+            if name_ids[node]:      names_nodes[names[name_ids[node]]] = node
+        return names_nodes
+
+    def layout(self):
+        """
+        Returns [x,y] drawing coordinates per node (compact trees only), placed as by Biopython's Phylo.draw. x is the
+        summed branch length from the root (unit branch lengths if the tree has none). y is the row of the node: leaves
+        are on rows 1..N in preorder and a branch node is midway between its first and last child.
+        """
+        num_nodes = len(self)
+        nodes = np.arange(num_nodes)
+        # x: add the branch length of each node to the id range of its subtree, with a difference array
+        dist = np.nan_to_num(self.dist,nan=0.0)
+        if num_nodes > 1 and not np.any(dist):
+            dist = np.ones(num_nodes)
+            dist[0] = 0
+        x_diff = np.zeros(num_nodes+1)
+        x_diff[:num_nodes] += dist
+        np.subtract.at(x_diff,self.subtree_end,dist)
+        x = np.cumsum(x_diff[:num_nodes])
+        #/
+        # y: leaf rows, then branch nodes from the last to the first id (children before parents)
+        is_leaf = self.first_child == -1
+        y = np.zeros(num_nodes)
+        y[is_leaf] = np.arange(1,np.count_nonzero(is_leaf)+1)
+        is_last_child = (self.next_sibling == -1) & (nodes != 0)
+        last_child = np.full(num_nodes,-1,dtype=np.int32)
+        last_child[self.parent[is_last_child]] = nodes[is_last_child]
+        y = y.tolist()
+        first_child = self.first_child.tolist()
+        last_child = last_child.tolist()
+        for node in np.flatnonzero(~is_leaf)[::-1].tolist():
+            y[node] = (y[first_child[node]]+y[last_child[node]])/2
+        #/
+        return [x,np.asarray(y)]
+
+    def save(self,output_file,indexes=None):
+        """
+        Saves the tree, and optionally a dict of derived index arrays, to a binary NumPy .npz file. Names are stored
+        as one utf-8 blob with offsets. The file is written to a temporary path first, so that an interrupted run does
+        not leave a broken cache behind.
+        """
+        tree = self if self.subtree_end is not None else self.compact()
+        names_encoded = [name.encode('utf-8') for name in tree.names]
+        names_offsets = np.zeros(len(names_encoded)+1,dtype=np.int64)
+        np.cumsum([len(name) for name in names_encoded],out=names_offsets[1:])
+        arrays = {'parent':tree.parent,'first_child':tree.first_child,'next_sibling':tree.next_sibling,
+                  'dist':tree.dist,'support':tree.support,'name_ids':tree.name_ids,'subtree_end':tree.subtree_end,
+                  'names_blob':np.frombuffer(b''.join(names_encoded),dtype=np.uint8),'names_offsets':names_offsets}
+        for index_name,index_array in (indexes or {}).items():
+            arrays['index_'+index_name] = np.asarray(index_array)
+        tmp_file = output_file+'.tmp'+str(os.getpid())
+        with open(tmp_file,'wb') as nf:
+            np.savez(nf,**arrays)
+        os.replace(tmp_file,output_file)
+
+    @classmethod
+    def load(cls,input_file):
+        """
+        Loads a tree saved with save(). Returns [tree,indexes].
+        """
+        with np.load(input_file,allow_pickle=False) as data:
+            names_blob = data['names_blob'].tobytes()
+            names_offsets = data['names_offsets'].tolist()
+            names = [names_blob[names_offsets[i]:names_offsets[i+1]].decode('utf-8') for i in range(len(names_offsets)-1)]
+            tree = cls(data['parent'],data['first_child'],data['next_sibling'],data['dist'],data['name_ids'],names,data['support'])
+            tree.subtree_end = data['subtree_end']
+            indexes = {key[len('index_'):]:data[key] for key in data.files if key.startswith('index_')}
+        return [tree,indexes]
+
+class LCAIndex:
+    """
+    Lowest common ancestor index of a compact FlexTree. It is the preorder variant of the Euler-tour reduction: for
+    preorder ids u < v where v is not in the subtree of u, LCA(u,v) is the parent of the shallowest node in (u,v]. The
+    minimum-depth node of any id range is found in O(1) with a sparse table (n log n node ids), built level by level
+    with NumPy.
+    """
+
+    def __init__(self,tree):
+        parent = tree.parent.tolist()
+        depth = [0]*len(parent)
+        for node in range(1,len(parent)): # compact tree: parents come before children
+            depth[node] = depth[parent[node]]+1
+        self.parent = tree.parent
+        self.subtree_end = tree.subtree_end
+        self.depth = np.asarray(depth,dtype=np.int32)
+        # sparse table: level k holds the minimum-depth node of every id range [i,i+2**k)
+        self.table = [np.arange(len(parent),dtype=np.int32)]
+        span = 1
+        while span*2 <= len(parent):
+            previous = self.table[-1]
+            left,right = previous[:len(previous)-span],previous[span:]
+            self.table.append(np.where(self.depth[right] < self.depth[left],right,left))
+            span *= 2
+        #/
+
+    def lca(self,node_a,node_b):
+        """
+        Returns the lowest common ancestor of two nodes.
+        """
+        if node_a > node_b:         node_a,node_b = node_b,node_a
+        if node_b < self.subtree_end[node_a]:       return int(node_a) # node_b is in the subtree of node_a
+        level = (node_b-node_a).bit_length()-1
+        left,right = self.table[level][node_a+1],self.table[level][node_b-(1<<level)+1]
+        shallowest = right if self.depth[right] < self.depth[left] else left
+        return int(self.parent[shallowest])
+
+    def lca_many(self,nodes_a,nodes_b):
+        """
+        Returns the lowest common ancestors of node pairs given as two equally long arrays.
+        """
+        nodes_a,nodes_b = np.asarray(nodes_a,dtype=np.int64),np.asarray(nodes_b,dtype=np.int64)
+        nodes_a,nodes_b = np.minimum(nodes_a,nodes_b),np.maximum(nodes_a,nodes_b)
+        is_ancestor = nodes_b < self.subtree_end[nodes_a]
+        lcas = nodes_a.copy()
+        query = np.flatnonzero(~is_ancestor)
+        if len(query):
+            range_start,range_end = nodes_a[query]+1,nodes_b[query] # inclusive range of ids
+            levels = np.floor(np.log2(range_end-range_start+1)).astype(np.int64)
+            for level in np.unique(levels).tolist():
+                in_level = np.flatnonzero(levels == level)
+                left = self.table[level][range_start[in_level]]
+                right = self.table[level][range_end[in_level]-(1<<level)+1]
+                shallowest = np.where(self.depth[right] < self.depth[left],right,left)
+                lcas[query[in_level]] = self.parent[shallowest]
+        return lcas
+
+def clade_value_counts(tree,leaves_values):
+    """
+    Yields [node,counts,majorities] for every node of a compact tree in postorder. counts is a dict of (column,value) ->
+    number of leaves in the clade of node with that value, majorities is a dict of column -> [count,value] of the most
+    common value per column (the first one reached on ties). leaves_values is a dict of leaf-node -> dict of column ->
+    value.
+    Counts of a finished clade are merged into its parent small-to-large (the smaller dict into the larger one), so
+    every leaf value is moved O(log n) times. The yielded dicts are reused by the parent: read them before the next
+    iteration.
+    """
+    parent = tree.parent.tolist()
+    nodes_counts = {} # node -> [counts,majorities] merged from its finished children
+    for node in range(len(parent)-1,-1,-1): # compact tree: children have higher ids than their parent
+        counts,majorities = nodes_counts.pop(node,None) or [{},{}]
+        for column,value in leaves_values.get(node,{}).items():
+            count = counts.get((column,value),0)+1
+            counts[(column,value)] = count
+            if not column in majorities or count > majorities[column][0]:      majorities[column] = [count,value]
+        yield [node,counts,majorities]
+        # merge into parent
+        node_parent = parent[node]
+        if node_parent < 0: continue
+        if not node_parent in nodes_counts:
+            nodes_counts[node_parent] = [counts,majorities]
+            continue
+        parent_counts,parent_majorities = nodes_counts[node_parent]
+        if len(parent_counts) < len(counts):
+            nodes_counts[node_parent] = [counts,majorities]
+            counts,parent_counts,parent_majorities = parent_counts,counts,majorities
+        for (column,value),count in counts.items():
+            count = parent_counts.get((column,value),0)+count
+            parent_counts[(column,value)] = count
+            if not column in parent_majorities or count > parent_majorities[column][0]:    parent_majorities[column] = [count,value]
+        #/
+
+TREE_CACHE_VERSION = 'flexmetr-tree-cache-2' # bump when the cached arrays or their meaning change
+
+def get_tree_cache_path(input_file,cache_dir,options=None,chunk_size=1048576):
+    """
+    Hashes the Newick content of input_file (path or "-" for stdin) together with options that change the parsed tree
+    (e.g. outgroup), and returns [path of the cache file in cache_dir,input to parse]. Input from stdin is kept in
+    memory, so that it can still be parsed after hashing.
+    """
+    content_hash = hashlib.sha256()
+    content_hash.update((TREE_CACHE_VERSION+repr(sorted((options or {}).items()))).encode('utf-8'))
+    if input_file == '-':
+        input_string = sys.stdin.read()
+        content_hash.update(input_string.encode('utf-8'))
+        input_file = io.StringIO(input_string)
+    else:
+        with open(input_file,'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size),b''):
+                content_hash.update(chunk)
+    return [os.path.join(cache_dir,content_hash.hexdigest()+'.npz'),input_file]
+
+def load_tree_cache(cache_path):
+    """
+    Returns [tree,indexes] from cache_path, or None if there is no (readable) cache file.
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        return FlexTree.load(cache_path)
+    except Exception as err:
+        print(f'WARNING: Could not read tree cache {cache_path} ({err}), will rebuild it')
+        return None
+
+def save_tree_cache(cache_path,tree,indexes=None):
+    """
+    Saves tree (and derived index arrays) to cache_path, making the cache directory if needed.
+    """
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir and not os.path.exists(cache_dir):        os.makedirs(cache_dir,exist_ok=True)
+    tree.save(cache_path,indexes)
+
+# Newick input is read as records: the text of a node (label and branch length, may hold quoted labels and comments)
+# followed by a punctuation character
+NEWICK_RECORD_RE = re.compile(r"""([^(),;'\[]*(?:(?:'(?:[^']|'')*'(?!')|\[[^\]]*\])[^(),;'\[]*)*)([(),;])""")
+NEWICK_TEXT_PART_RE = re.compile(r"""'((?:[^']|'')*)'|\[[^\]]*\]|(:)|([^'\[:]+)""")
+NEWICK_ILLEGAL_NAME_CHARS = str.maketrans({char:'_' for char in ':;(),[]\t\n\r='})
+
+def parse_newick_node_text(text):
+    """
+    Returns label and branch length (string, None if not given) from a node text with quoted labels or comments.
+    """
+    label = ''
+    length = None
+    for quoted_label,colon,plain_text in NEWICK_TEXT_PART_RE.findall(text):
+        if colon:
+            length = ''
+        elif length is not None:
+            length += plain_text.strip()
+        elif quoted_label:
+            label += quoted_label.replace("''","'")
+        else:
+            label += plain_text.strip()
+        # else: comment
+    return label,length
+
+def read_newick(input_file,default_dist=np.nan,chunk_size=1048576):
+    """
+    Parses a Newick tree from a path, "-" (stdin) or a file object into a FlexTree. The input is read in chunks and
+    parsed without recursion, so deep (e.g. ladder-like) trees are fine.
+    Quoted labels and comments are supported (comments are skipped). Labels of branch-nodes that are numbers are read as
+    branch support values (as ete3 and Biopython do), other labels as names. Missing branch lengths are set to
+    default_dist. Text after the first ";" is ignored.
+    """
+    if input_file == '-':
+        return read_newick(sys.stdin,default_dist=default_dist,chunk_size=chunk_size)
+    if isinstance(input_file,str):
+        with open(input_file,'r') as f:
+            return read_newick(f,default_dist=default_dist,chunk_size=chunk_size)
+
+    parents = array('i')
+    dists = array('d')
+    labels = []
+    open_nodes = [] # stack of branch-nodes with their children being parsed
+    node = -1 # node that the next text applies to (-1: none, a new leaf-node is made for it)
+    buffer = ''
+    tree_done = False
+    while not tree_done:
+        # read chunk and split it into records. Without quotes and comments in the buffer, every punctuation character
+        # ends a record (fast). Else, records are matched one by one
+        chunk = input_file.read(chunk_size)
+        buffer += chunk
+        if not chunk:
+            if not buffer.strip():
+                break
+            if NEWICK_RECORD_RE.match(buffer) or buffer.count("'") % 2:
+                raise ValueError(f'Newick: unexpected text: {buffer[:50]}')
+            records = [(buffer,';')] # text after the last punctuation (e.g. root label without ";")
+            buffer = ''
+        elif not ("'" in buffer or '[' in buffer):
+            records = NEWICK_RECORD_RE.findall(buffer)
+            buffer = buffer[max(buffer.rfind(char) for char in '(),;')+1:]
+        else:
+            records = []
+            pos = 0
+            while True:
+                match = NEWICK_RECORD_RE.match(buffer,pos)
+                if match is None: break
+                records.append(match.groups())
+                pos = match.end()
+            buffer = buffer[pos:]
+        #/
+        for text,punctuation in records:
+            # parse label and branch length. Add leaf-node if no node was made for them
+            if text:
+                if "'" in text or '[' in text:
+                    label,length = parse_newick_node_text(text)
+                else:
+                    label,colon,length = text.partition(':')
+                    label = label.strip()
+                    if not colon:       length = None
+                if label or length is not None:
+                    if node == -1:
+                        node = len(labels)
+                        parents.append(open_nodes[-1] if open_nodes else -1)
+                        dists.append(default_dist)
+                        labels.append(label)
+                    else:
+                        labels[node] += label
+                    if length:
+                        try:
+                            dists[node] = float(length)
+                        except ValueError:
+                            raise ValueError(f'Newick: could not parse branch length "{length}"')
+            #/
+            # open/close branch-nodes
+            if punctuation == '(':
+                if not open_nodes and labels:
+                    raise ValueError('Newick: unexpected data outside the root node (is a ";" missing?)')
+                node = len(labels)
+                parents.append(open_nodes[-1] if open_nodes else -1)
+                dists.append(default_dist)
+                labels.append('')
+                open_nodes.append(node)
+                node = -1
+            elif punctuation == ';':
+                tree_done = True
+                break
+            else:
+                if not open_nodes:
+                    raise ValueError(f'Newick: unexpected "{punctuation}" outside of parentheses')
+                if node == -1: # empty leaf-node, e.g. "(A,)"
+                    parents.append(open_nodes[-1])
+                    dists.append(default_dist)
+                    labels.append('')
+                node = open_nodes.pop() if punctuation == ')' else -1
+            #/
+
+    if open_nodes:
+        raise ValueError(f'Newick: {len(open_nodes)} parentheses were not closed')
+    if not labels:
+        raise ValueError('Newick: no tree found in input')
+
+    # read numeric labels of branch-nodes as support values
+    supports = np.full(len(labels),np.nan)
+    has_children = np.zeros(len(labels),dtype=bool)
+    has_children[np.asarray(parents)[1:]] = True
+    for node in np.flatnonzero(has_children).tolist():
+        if labels[node]:
+            try:
+                supports[node] = float(labels[node])
+                labels[node] = ''
+            except ValueError:
+                pass
+    #/
+    return FlexTree.from_parents(parents,dists,labels,supports,preorder=True) # nodes were added in preorder
+
+def write_newick(tree,output_file,dist_format='%0.6g',buffer_size=65536):
+    """
+    Writes a FlexTree in Newick format to a path, "-" (stdout) or a file object, in buffered pieces instead of one
+    string. Leaf and branch-node names are written with branch lengths (not set: skipped), in the same way as
+    ete3 write(format=1): characters that are not allowed in Newick names are replaced by "_" and the root has no
+    label or length.
+    """
+    if output_file == '-':
+        write_newick(tree,sys.stdout,dist_format=dist_format,buffer_size=buffer_size)
+        sys.stdout.flush()
+        return
+    if isinstance(output_file,str):
+        with open(output_file,'w') as nf:
+            write_newick(tree,nf,dist_format=dist_format,buffer_size=buffer_size)
+        return
+
+    names = [name.translate(NEWICK_ILLEGAL_NAME_CHARS) for name in tree.names]
+    name_ids = tree.name_ids.tolist()
+    dist = tree.dist.tolist()
+    parent = tree.parent.tolist()
+    first_child = tree.first_child.tolist()
+    next_sibling = tree.next_sibling.tolist()
+    def format_node(node):
+        if dist[node] != dist[node]:        return names[name_ids[node]] # nan
+        return names[name_ids[node]]+':'+(dist_format % dist[node])
+
+    if first_child[0] == -1:
+        output_file.write(names[name_ids[0]]+';\n') # single-node tree
+        return
+    pieces = ['(']
+    node = first_child[0]
+    while True:
+        # descend to first leaf-node
+        while first_child[node] != -1:
+            pieces.append('(')
+            node = first_child[node]
+        pieces.append(format_node(node))
+        #/
+        # close finished branch-nodes, then continue at next sibling
+        while next_sibling[node] == -1:
+            node = parent[node]
+            pieces.append(')')
+            if node == 0: break
+            pieces.append(format_node(node))
+        if node == 0: break
+        pieces.append(',')
+        node = next_sibling[node]
+        #/
+        if len(pieces) >= buffer_size:
+            output_file.write(''.join(pieces))
+            pieces = []
+    pieces.append(';\n')
+    output_file.write(''.join(pieces))
+
+def write_svg(tree,output_file,layout=None,leaf_tracks=None,areas=None,row_height=14,tree_width=800,track_width=14,
+              buffer_size=65536):
+    """
+    Writes a compact FlexTree as an SVG drawing, streamed in buffered pieces while the nodes are visited in preorder
+    (one path element per node), so that no drawing objects are kept in memory. layout is [x,y] from tree.layout().
+    Clade areas (list of [node,color,label]) are drawn behind the tree, then the metadata tracks (list of
+    [label,{leaf name: color}]) as one column of dots per track, followed by the leaf names.
+    """
+    if layout is None:      layout = tree.layout()
+    leaf_tracks = leaf_tracks or []
+    areas = areas or []
+    nodes_x,nodes_y = layout
+    leaf_order,leaf_lo,leaf_hi = tree.leaf_intervals()
+    
+    # set drawing coordinates: tree, then a column per track, then leaf names. Track labels are written above the rows
+    margin = 10
+    header_height = 150
+    x_max = float(nodes_x.max())
+    x_scale = tree_width/x_max if x_max > 0 else 0
+    tracks_x = margin+tree_width+track_width
+    labels_x = tracks_x+len(leaf_tracks)*track_width
+    width = labels_x+400
+    height = header_height+(len(leaf_order)+1)*row_height
+    def to_x(x_val):    return margin+x_val*x_scale
+    def to_y(y_val):    return header_height+y_val*row_height
+    #/
+    names = tree.names
+    name_ids = tree.name_ids.tolist()
+    parent = tree.parent.tolist()
+    first_child = tree.first_child.tolist()
+    nodes_x = nodes_x.tolist()
+    nodes_y = nodes_y.tolist()
+    with open(output_file,'w') as nf:
+        pieces = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+                  f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" font-family="sans-serif" font-size="{row_height*0.8:g}">\n']
+        # clade areas (rows of the leaves of the clade, from the node to the end of the tree)
+        pieces.append('<g fill-opacity="0.3" stroke="none">\n')
+        for node,color,label in areas:
+            area_xstart,area_xend = to_x(nodes_x[node]),to_x(x_max)
+            area_ystart,area_yend = to_y(leaf_lo[node]+1),to_y(leaf_hi[node])
+            pieces.append(f'<rect x="{area_xstart:.2f}" y="{area_ystart:.2f}" width="{area_xend-area_xstart:.2f}" height="{area_yend-area_ystart:.2f}" fill="{color}"/>\n')
+            pieces.append(f'<text x="{area_xstart+(area_xend-area_xstart)*0.1:.2f}" y="{(area_ystart+area_yend)/2:.2f}" fill-opacity="1" fill="black">{escape(str(label))}</text>\n')
+        pieces.append('</g>\n')
+        #/
+        # tree: branch of each node, and the vertical line joining the children of branch nodes
+        pieces.append('<g fill="none" stroke="black" stroke-width="1">\n')
+        for node in tree.preorder():
+            x_start = nodes_x[parent[node]] if node != 0 else 0
+            path = f'M{to_x(x_start):.2f},{to_y(nodes_y[node]):.2f}H{to_x(nodes_x[node]):.2f}'
+            if first_child[node] != -1:
+                y_top = nodes_y[first_child[node]]
+                y_bot = 2*nodes_y[node]-y_top # node is midway between its first and last child
+                path += f'M{to_x(nodes_x[node]):.2f},{to_y(y_top):.2f}V{to_y(y_bot):.2f}'
+            pieces.append(f'<path d="{path}"/>\n')
+            if len(pieces) >= buffer_size:
+                nf.write(''.join(pieces))
+                pieces = []
+        pieces.append('</g>\n')
+        #/
+        # track labels, then per leaf its track dots and name
+        for track_enum,(label,_) in enumerate(leaf_tracks):
+            track_x = tracks_x+track_enum*track_width
+            pieces.append(f'<text x="{track_x:.2f}" y="{header_height-margin:.2f}" transform="rotate(-45 {track_x:.2f} {header_height-margin:.2f})">{escape(str(label))}</text>\n')
+        for leaf_node in leaf_order.tolist():
+            leaf_name = names[name_ids[leaf_node]]
+            leaf_y = to_y(nodes_y[leaf_node])
+            for track_enum,(_,leafs_colors) in enumerate(leaf_tracks):
+                if leaf_name in leafs_colors:
+                    pieces.append(f'<circle cx="{tracks_x+track_enum*track_width:.2f}" cy="{leaf_y:.2f}" r="{track_width*0.35:.2f}" fill="{leafs_colors[leaf_name]}"/>\n')
+            pieces.append(f'<text x="{labels_x:.2f}" y="{leaf_y:.2f}" dominant-baseline="middle">{escape(leaf_name)}</text>\n')
+            if len(pieces) >= buffer_size:
+                nf.write(''.join(pieces))
+                pieces = []
+        #/
+        pieces.append('</svg>\n')
+        nf.write(''.join(pieces))
@@ -6,5 +6,5 @@ setuptools.setup(
     author='jaclew',
     description='no_description',
     packages=['flexmetr_alpha'],
-    scripts=['flexmetr_alpha/flexmetr_alpha','flexmetr_alpha/assign.py','flexmetr_alpha/tree.py','flexmetr_alpha/organize.py','flexmetr_alpha/tree2.py','flexmetr_alpha/global_functions.py']
+    scripts=['flexmetr_alpha/flexmetr_alpha','flexmetr_alpha/assign.py','flexmetr_alpha/tree.py','flexmetr_alpha/organize.py','flexmetr_alpha/tree2.py','flexmetr_alpha/global_functions.py','flexmetr_alpha/tree_core.py']
 )